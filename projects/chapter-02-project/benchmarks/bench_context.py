@@ -0,0 +1,78 @@
+"""
+Micro-benchmark: token accounting in manage_context.
+
+Compares the original pop(0)-and-recount trimming loop, with its original
+uncached token counter, against the deque / running-total implementation on
+a 10k-message history (or `n` messages).
+
+Run: python benchmarks/bench_context.py [n]
+"""
+
+import math
+import os
+import sys
+import timeit
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
+
+from smart_troubleshooting import manage_context  # noqa: E402
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def count_tokens_uncached(text: str, model: str = "gpt-4o-mini") -> int:
+    """Previous count_tokens: looks up the encoding and encodes on every call."""
+    if tiktoken:
+        enc = tiktoken.get_encoding("cl100k_base")
+        return len(enc.encode(text))
+    return max(1, math.ceil(len(text) / 4))
+
+
+def manage_context_quadratic(messages: List[Dict], max_tokens: int = 6000) -> List[Dict]:
+    """Previous implementation: recounts the whole history after every pop(0)."""
+    if not messages:
+        return messages
+
+    system_msgs = [m for m in messages if m.get("role") == "system"]
+    others = [m for m in messages if m.get("role") != "system"]
+
+    def total_tokens(msgs: List[Dict]) -> int:
+        return sum(count_tokens_uncached(m.get("content", "")) for m in msgs)
+
+    trimmed = others[:]
+    while total_tokens(system_msgs + trimmed) > max_tokens and trimmed:
+        trimmed.pop(0)
+
+    return system_msgs + trimmed
+
+
+def build_history(n: int) -> List[Dict]:
+    history = [{"role": "system", "content": "You are a helpful IoT troubleshooting assistant."}]
+    for i in range(n // 2):
+        history.append({"role": "user", "content": f"Sensor {i} reports an out-of-range reading"})
+        history.append({"role": "assistant", "content": f"Recalibrate sensor {i} and check wiring"})
+    return history
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    history = build_history(n)
+    max_tokens = 6000
+    assert manage_context(history, max_tokens) == manage_context_quadratic(history, max_tokens)
+
+    print(f"{len(history)} messages, tiktoken {'installed' if tiktoken else 'missing (chars / 4)'}")
+    # The old loop is slow enough that a single timed call is plenty
+    for name, func, number, repeat in [
+        ("quadratic (before)", manage_context_quadratic, 1, 1),
+        ("deque (after)", manage_context, 20, 3),
+    ]:
+        seconds = min(timeit.repeat(lambda: func(history, max_tokens), number=number, repeat=repeat)) / number
+        print(f"{name:<20} {seconds * 1000:10.2f} ms per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,13 @@ Design goals:
 from __future__ import annotations
 
 import hashlib
+import json
 import math
-from typing import List, Tuple, Dict
+import os
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Tuple, Dict, Optional, Sequence, Union
 
 import numpy as np
 
@@ -22,6 +27,11 @@ try:
 except ImportError:
     tiktoken = None
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 
 # --- Token counting and cost -------------------------------------------------
 
@@ -31,13 +41,23 @@ PRICING_PER_MILLION = {
 }
 
 
-def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+@lru_cache(maxsize=None)
+def _get_encoding(name: str = "cl100k_base"):
+    """Load a tiktoken encoding once per process; `get_encoding` is not cheap."""
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=65536)
+def _count_text_tokens(text: str) -> int:
     if tiktoken:
-        enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(text))
+        return len(_get_encoding().encode(text))
     return max(1, math.ceil(len(text) / 4))
 
 
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    return _count_text_tokens(text)
+
+
 def estimate_cost(text: str, is_input: bool = True, model: str = "gpt-4o-mini") -> float:
     tokens = count_tokens(text, model)
     pricing = PRICING_PER_MILLION.get(model, PRICING_PER_MILLION["default"])
@@ -65,42 +85,262 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return float(np.dot(a, b) / denom)
 
 
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; all-zero rows are left as zeros."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Column indices of the `top_k` best scores per row, best first."""
+    n = scores.shape[1]
+    k = min(top_k, n)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), (scores.shape[0], n))
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+class SolutionIndex:
+    """Cosine-similarity index over a knowledge base.
+
+    Embeddings are normalized once and stored as a single contiguous float32
+    matrix, so a lookup is one matrix product plus an `argpartition` instead
+    of a Python loop over every solution.
+    """
+
+    def __init__(self, solutions: Sequence[str], embeddings=None):
+        self.solutions = list(solutions)
+        if embeddings is None:
+            embeddings = create_knowledge_base_embeddings(self.solutions)
+        if len(embeddings) == 0:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            matrix = np.array(embeddings, dtype=np.float32, order="C", ndmin=2)
+        if matrix.shape[0] != len(self.solutions):
+            raise ValueError("solutions and embeddings must have the same length")
+        self.matrix = _normalize_rows(matrix)
+
+    def __len__(self) -> int:
+        return len(self.solutions)
+
+    def search_batch(
+        self, query_embeddings: np.ndarray, top_k: int = 1
+    ) -> List[List[Tuple[str, float]]]:
+        """Score a (n_queries, dims) matrix against the index in one GEMM."""
+        queries = np.array(query_embeddings, dtype=np.float32, order="C", ndmin=2)
+        if len(self) == 0 or top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+        scores = _normalize_rows(queries) @ self.matrix.T
+        best = _top_k(scores, top_k)
+        return [
+            [(self.solutions[j], float(row_scores[j])) for j in row_idx]
+            for row_scores, row_idx in zip(scores, best)
+        ]
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 1) -> List[Tuple[str, float]]:
+        return self.search_batch(query_embedding, top_k)[0]
+
+    def query_batch(self, problems: Sequence[str], top_k: int = 1) -> List[List[Tuple[str, float]]]:
+        """Embed and score many user problems at once."""
+        if not problems:
+            return []
+        return self.search_batch(np.stack([create_embedding(p) for p in problems]), top_k)
+
+    def query(self, problem: str, top_k: int = 1) -> List[Tuple[str, float]]:
+        return self.query_batch([problem], top_k)[0]
+
+    @classmethod
+    def from_normalized(cls, solutions: Sequence[str], matrix: np.ndarray) -> "SolutionIndex":
+        """Wrap an already unit-normalized matrix (e.g. a read-only memmap) without copying it."""
+        if matrix.shape[0] != len(solutions):
+            raise ValueError("solutions and embeddings must have the same length")
+        index = cls.__new__(cls)
+        index.solutions = list(solutions)
+        index.matrix = matrix
+        return index
+
+
 def find_best_solution(
     user_problem: str,
     solutions: List[str],
-    embeddings: List[np.ndarray],
+    embeddings: Union[List[np.ndarray], SolutionIndex, "EmbeddingStore"],
 ) -> Tuple[str, float]:
-    problem_emb = create_embedding(user_problem)
-    best_idx = -1
-    best_score = -1.0
-    for idx, emb in enumerate(embeddings):
-        score = cosine_similarity(problem_emb, emb)
-        if score > best_score:
-            best_idx = idx
-            best_score = score
-    if best_idx == -1:
+    """Best match for `user_problem`; pass a prebuilt SolutionIndex or an
+    EmbeddingStore to avoid re-indexing."""
+    if isinstance(embeddings, EmbeddingStore):
+        index = embeddings.index()
+    elif isinstance(embeddings, SolutionIndex):
+        index = embeddings
+    else:
+        index = SolutionIndex(solutions, embeddings)
+    matches = index.query(user_problem, top_k=1)
+    if not matches:
         return "No solution found.", 0.0
-    return solutions[best_idx], best_score
+    return matches[0]
+
+
+# --- Persistent embedding store ----------------------------------------------
+
+class EmbeddingStore:
+    """Append-only on-disk embedding store.
+
+    Layout inside `directory`:
+    - `embeddings.f32`: raw row-major float32 matrix of unit-normalized rows,
+      opened read-only with `np.memmap` so processes share the page cache.
+    - `metadata.jsonl`: one JSON object per row (`{"text": ...}`), in row order.
+    - `store.json`: header with the embedding dimensionality.
+
+    New rows are appended to both files, so the existing data is never
+    rewritten. Readers take the smaller of the two files as the row count, so
+    a torn append (a crash between or during the two writes) is not visible.
+    The next `add` truncates both files back to the last complete row before
+    appending, so the leftover bytes are never paired with later rows.
+    Writers hold an exclusive lock on `store.lock` while appending (POSIX
+    `flock`; there is no lock on Windows, so use a single writer there).
+    """
+
+    MATRIX_FILE = "embeddings.f32"
+    METADATA_FILE = "metadata.jsonl"
+    HEADER_FILE = "store.json"
+    LOCK_FILE = "store.lock"
+
+    def __init__(self, directory: str, dims: int = 96):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        header_path = os.path.join(directory, self.HEADER_FILE)
+        if os.path.exists(header_path):
+            with open(header_path, "r", encoding="utf-8") as f:
+                self.dims = int(json.load(f)["dims"])
+        else:
+            self.dims = dims
+            with open(header_path, "w", encoding="utf-8") as f:
+                json.dump({"dims": dims, "dtype": "float32"}, f)
+        self._matrix_path = os.path.join(directory, self.MATRIX_FILE)
+        self._metadata_path = os.path.join(directory, self.METADATA_FILE)
+        self._lock_path = os.path.join(directory, self.LOCK_FILE)
+        self._index: Optional[SolutionIndex] = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Re-read the sidecar and remap the matrix (picks up appends by other processes)."""
+        texts: List[str] = []
+        ends: List[int] = []  # byte offset after each complete record
+        if os.path.exists(self._metadata_path):
+            with open(self._metadata_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partially written trailing record
+                    offset += len(line)
+                    texts.append(json.loads(line)["text"])
+                    ends.append(offset)
+        self._row_bytes = self.dims * np.dtype(np.float32).itemsize
+        size = os.path.getsize(self._matrix_path) if os.path.exists(self._matrix_path) else 0
+        rows = min(len(texts), size // self._row_bytes)
+        self.texts = texts[:rows]
+        self._metadata_bytes = ends[rows - 1] if rows else 0
+        self._known = set(self.texts)
+        if rows:
+            self.matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r", shape=(rows, self.dims))
+        else:
+            self.matrix = np.zeros((0, self.dims), dtype=np.float32)
+        self._index = None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._known
+
+    def add(self, texts: Sequence[str], embeddings=None) -> int:
+        """Append entries that are not already stored; returns how many were added."""
+        if not any(t not in self._known for t in texts):
+            return 0
+        with self._locked():
+            self.refresh()  # other writers may have appended since we last looked
+            added = self._append(texts, embeddings)
+        self.refresh()
+        return added
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, texts: Sequence[str], embeddings) -> int:
+        new = [t for t in dict.fromkeys(texts) if t not in self._known]
+        if not new:
+            return 0
+        if embeddings is None:
+            rows = np.stack([create_embedding(t, self.dims) for t in new])
+        else:
+            lookup = dict(zip(texts, embeddings))
+            rows = np.stack([np.asarray(lookup[t]) for t in new])
+        rows = _normalize_rows(np.array(rows, dtype=np.float32, order="C"))
+        if rows.shape[1] != self.dims:
+            raise ValueError(f"expected {self.dims}-dim embeddings, got {rows.shape[1]}")
+
+        # Drop whatever a torn append left behind, then write matrix first and
+        # metadata second: a crash in between leaves an orphan row that
+        # `refresh` ignores and the next append truncates.
+        self.matrix = None  # release the memmap before truncating under it
+        self._index = None
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(len(self.texts) * self._row_bytes)
+            f.write(rows.tobytes())
+        with open(self._metadata_path, "ab") as f:
+            f.truncate(self._metadata_bytes)
+            f.writelines((json.dumps({"text": t}) + "\n").encode("utf-8") for t in new)
+        return len(new)
+
+    def index(self) -> SolutionIndex:
+        """SolutionIndex backed directly by the memmap (no copy)."""
+        if self._index is None:
+            self._index = SolutionIndex.from_normalized(self.texts, self.matrix)
+        return self._index
+
+
+def open_knowledge_base(directory: str, solutions: Sequence[str] = ()) -> EmbeddingStore:
+    """Open (or create) a store and embed only the solutions it doesn't have yet."""
+    store = EmbeddingStore(directory)
+    store.add(solutions)
+    return store
 
 
 # --- Context management ------------------------------------------------------
 
 def manage_context(messages: List[Dict], max_tokens: int = 6000) -> List[Dict]:
-    """Keep system message; trim oldest user/assistant messages to fit the limit."""
+    """Keep system message; trim oldest user/assistant messages to fit the limit.
+
+    Each message is counted once and trimming keeps a running total over a
+    deque, so the cost is linear in history length.
+    """
     if not messages:
         return messages
 
     system_msgs = [m for m in messages if m.get("role") == "system"]
-    others = [m for m in messages if m.get("role") != "system"]
+    others = deque(
+        (m, count_tokens(m.get("content", ""))) for m in messages if m.get("role") != "system"
+    )
 
-    def total_tokens(msgs: List[Dict]) -> int:
-        return sum(count_tokens(m.get("content", "")) for m in msgs)
+    total = sum(count_tokens(m.get("content", "")) for m in system_msgs)
+    total += sum(tokens for _, tokens in others)
+    while total > max_tokens and others:
+        _, tokens = others.popleft()
+        total -= tokens
 
-    trimmed = others[:]
-    while total_tokens(system_msgs + trimmed) > max_tokens and trimmed:
-        trimmed.pop(0)
-
-    return system_msgs + trimmed
+    return system_msgs + [m for m, _ in others]
 
 
 # --- CLI ---------------------------------------------------------------------
@@ -117,8 +357,11 @@ SOLUTIONS = [
 ]
 
 
-def run_cli():
-    embeddings = create_knowledge_base_embeddings(SOLUTIONS)
+KB_STORE_DIR = os.getenv("KB_STORE_DIR", os.path.join(os.path.dirname(__file__), ".kb_store"))
+
+
+def run_cli(store_dir: str = KB_STORE_DIR):
+    store = open_knowledge_base(store_dir, SOLUTIONS)
     history: List[Dict] = [
         {"role": "system", "content": "You are a helpful IoT troubleshooting assistant."}
     ]
@@ -130,7 +373,7 @@ def run_cli():
         if user.lower() in {"quit", "exit"}:
             break
 
-        best_solution, score = find_best_solution(user, SOLUTIONS, embeddings)
+        best_solution, score = find_best_solution(user, store.texts, store)
         cost_estimate = estimate_cost(user, is_input=True)
         reply = (
             f"Suggested fix (similarity {score:.2f}): {best_solution}"
@@ -6,6 +6,9 @@ from chapter_02_project.solution.smart_troubleshooting import (
     create_embedding,
     create_knowledge_base_embeddings,
     find_best_solution,
+    SolutionIndex,
+    EmbeddingStore,
+    open_knowledge_base,
     manage_context,
 )
 
@@ -29,6 +32,73 @@ def test_embeddings_and_similarity():
     assert 0.0 <= score <= 1.0
 
 
+def test_solution_index_matches_bruteforce():
+    solutions = [f"Fix number {i}" for i in range(200)]
+    embs = create_knowledge_base_embeddings(solutions)
+    index = SolutionIndex(solutions, embs)
+    assert index.matrix.dtype == np.float32
+    assert index.matrix.flags["C_CONTIGUOUS"]
+
+    query = create_embedding("sensor offline")
+    expected = sorted(
+        range(len(embs)), key=lambda i: float(np.dot(query, embs[i])), reverse=True
+    )[:5]
+    results = index.search(query, top_k=5)
+    assert [solutions.index(s) for s, _ in results] == expected
+    assert [score for _, score in results] == sorted((s for _, s in results), reverse=True)
+
+    best, score = find_best_solution("sensor offline", solutions, index)
+    assert (best, score) == results[0]
+
+
+def test_solution_index_batch_query():
+    solutions = ["Restart router", "Replace battery", "Update firmware"]
+    index = SolutionIndex(solutions)
+    batch = index.query_batch(["wifi issue", "battery low"], top_k=2)
+    assert len(batch) == 2
+    single = index.query("wifi issue", top_k=2)
+    assert [s for s, _ in batch[0]] == [s for s, _ in single]
+    assert np.allclose([x for _, x in batch[0]], [x for _, x in single])
+    assert all(len(row) == 2 for row in batch)
+    assert SolutionIndex([], []).query("anything") == []
+
+
+def test_embedding_store_persists_and_appends(tmp_path):
+    solutions = ["Restart router", "Replace battery"]
+    store = open_knowledge_base(str(tmp_path), solutions)
+    assert len(store) == 2
+    assert isinstance(store.matrix, np.memmap)
+    before = (tmp_path / EmbeddingStore.MATRIX_FILE).read_bytes()
+
+    # Reopening embeds nothing new; adding appends without rewriting existing rows
+    reopened = open_knowledge_base(str(tmp_path), solutions + ["Update firmware"])
+    assert reopened.texts == solutions + ["Update firmware"]
+    assert (tmp_path / EmbeddingStore.MATRIX_FILE).read_bytes().startswith(before)
+
+    best, score = find_best_solution("Replace battery", reopened.texts, reopened)
+    assert best == "Replace battery"
+    assert abs(score - 1.0) < 1e-5
+
+
+def test_embedding_store_recovers_from_torn_append(tmp_path):
+    store = open_knowledge_base(str(tmp_path), ["Restart router", "Replace battery"])
+    row_bytes = store.dims * 4
+    # Crash mid-append: a row and a half of matrix, half a metadata record
+    with open(tmp_path / EmbeddingStore.MATRIX_FILE, "ab") as f:
+        f.write(create_embedding("Orphan").tobytes() + b"\0" * (row_bytes // 2))
+    with open(tmp_path / EmbeddingStore.METADATA_FILE, "a", encoding="utf-8") as f:
+        f.write('{"text": "Orph')
+
+    reopened = open_knowledge_base(str(tmp_path), ["Update firmware"])
+    assert reopened.texts == ["Restart router", "Replace battery", "Update firmware"]
+    assert (tmp_path / EmbeddingStore.MATRIX_FILE).stat().st_size == 3 * row_bytes
+
+    for text in reopened.texts:
+        best, score = find_best_solution(text, reopened.texts, reopened)
+        assert best == text
+        assert abs(score - 1.0) < 1e-5
+
+
 def test_manage_context_trims_old_messages():
     messages = [{"role": "system", "content": "sys"}]
     for i in range(50):
@@ -39,3 +109,16 @@ def test_manage_context_trims_old_messages():
     assert any(m.get("role") == "system" for m in trimmed)
     assert len(trimmed) < len(messages)
 
+
+
+def test_manage_context_keeps_newest_within_budget():
+    messages = [{"role": "system", "content": "sys"}]
+    messages += [{"role": "user", "content": f"message number {i}"} for i in range(2000)]
+    trimmed = manage_context(messages, max_tokens=500)
+    total = sum(count_tokens(m["content"]) for m in trimmed)
+    assert total <= 500
+    assert trimmed[0]["role"] == "system"
+    assert trimmed[-1] == messages[-1]
+    # Dropping one more message from the front must have been unnecessary
+    dropped = messages[len(messages) - len(trimmed)]
+    assert total + count_tokens(dropped["content"]) > 500
@@ -3,13 +3,32 @@ Production Command Processor - Complete Solution
 Chapter 8 Project
 
 Demonstrates production patterns: error handling, retries, rate limiting, caching.
+Concurrent identical commands are coalesced into a single LLM call, and
+responses are kept in a bounded, optionally persistent cache (llm_cache.py).
+LLM calls go through a process-wide rate limiter with adaptive concurrency
+(rate_limit.py) and are retried with jittered backoff behind a per-endpoint
+circuit breaker (retry_policy.py).
+
+`process_commands` streams results for many commands with a bounded number
+in flight; `python command_processor.py --batch FILE` (or piping commands
+on stdin) uses it to write one JSON line per command.
 """
 
+import argparse
+import asyncio
+import json
 import os
+import sys
 import time
-from functools import wraps
+from functools import partial, wraps
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Optional, Union
 from dotenv import load_dotenv
 
+from llm_cache import LLMCache
+from rate_limit import AdaptiveConcurrency, LLMLimiter, estimate_tokens, shared_limiter
+from retry_policy import CircuitOpenError, RetryPolicy
+from single_flight import AsyncSingleFlight, SingleFlight
+
 try:
     import openai
     OPENAI_AVAILABLE = True
@@ -17,30 +36,56 @@ except ImportError:
     OPENAI_AVAILABLE = False
 
 
-def retry_with_backoff(max_retries: int = 3, initial_delay: float = 1.0):
-    """Decorator for retrying with exponential backoff."""
+def retry_with_backoff(max_retries: int = 3, initial_delay: float = 1.0,
+                       deadline: Optional[float] = None, endpoint: Optional[str] = None,
+                       policy: Optional[RetryPolicy] = None):
+    """Decorator for retrying transient errors with jittered backoff.
+    
+    Works on plain and async functions (the async wrapper doesn't block the
+    loop). Pass `policy` to share one RetryPolicy, or `endpoint` to go
+    through that endpoint's circuit breaker.
+    """
+    policy = policy or RetryPolicy(max_attempts=max_retries, base_delay=initial_delay, deadline=deadline)
+    
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await policy.acall(partial(func, *args, **kwargs), endpoint=endpoint)
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            delay = initial_delay
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise
-                    time.sleep(delay)
-                    delay *= 2
-            return None
+            return policy.call(partial(func, *args, **kwargs), endpoint=endpoint)
         return wrapper
     return decorator
 
 
 class CommandProcessor:
-    """Production-ready command processor."""
+    """Production-ready command processor.
+    
+    Safe to share between threads. When many devices send the same command
+    at once, only one LLM request is made and every caller gets its result
+    (`process_command` for threads, `aprocess_command` for asyncio).
+    """
     
-    def __init__(self):
-        """Initialize processor."""
+    MODEL = "gpt-4o-mini"
+    
+    def __init__(self, cache: Optional[LLMCache] = None, limiter: Optional[LLMLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        """Initialize processor.
+        
+        Without `cache`, responses are cached in memory (COMMAND_CACHE_ENTRIES
+        entries, COMMAND_CACHE_TTL seconds) and, if COMMAND_CACHE_PATH is
+        set, in a SQLite file there.
+        
+        Without `limiter`, every processor in the process shares one limiter
+        per model, configured by LLM_REQUESTS_PER_MINUTE,
+        LLM_TOKENS_PER_MINUTE and LLM_MAX_CONCURRENCY.
+        
+        Without `retry_policy`, transient errors get LLM_MAX_ATTEMPTS
+        attempts within LLM_RETRY_DEADLINE seconds.
+        """
         load_dotenv()
         
         if not OPENAI_AVAILABLE:
@@ -50,30 +95,229 @@ class CommandProcessor:
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found")
         
-        self.client = openai.OpenAI(api_key=api_key)
-        self.cache = {}  # Simple cache
+        # The SDK's own retries would hide 429s from the limiter
+        self.client = openai.OpenAI(api_key=api_key, max_retries=0)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.cache = cache or LLMCache(
+            max_entries=int(os.getenv("COMMAND_CACHE_ENTRIES", "1024")),
+            ttl=float(os.getenv("COMMAND_CACHE_TTL", "3600")),
+            path=os.getenv("COMMAND_CACHE_PATH"),
+        )
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        self.limiter = limiter or shared_limiter(
+            f"openai:{self.MODEL}",
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000")),
+            concurrency=AdaptiveConcurrency(initial=min(8, max_concurrency), max_limit=max_concurrency),
+        )
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "4")),
+            deadline=float(os.getenv("LLM_RETRY_DEADLINE", "60")),
+        )
+        # Circuit breakers are per endpoint, shared by every processor
+        self.endpoint = f"{self.client.base_url}chat/completions"
+    
+    def _messages(self, command: str):
+        return [{"role": "user", "content": f"Process this IoT command: {command}"}]
     
-    @retry_with_backoff(max_retries=3)
     def process_command(self, command: str) -> str:
-        """Process IoT command."""
-        # Check cache
-        if command in self.cache:
-            return self.cache[command]
+        """Process IoT command.
         
-        try:
+        Raises the provider's error once retries are exhausted, or
+        CircuitOpenError while the endpoint is failing.
+        """
+        # Check cache
+        cached = self.cache.get(command)
+        if cached is not None:
+            return cached
+        return self.flight.do(self._flight_key(command), self._call_llm, command)
+    
+    def _flight_key(self, command: str):
+        # Coalesce only commands with the same devices: their responses match
+        key, devices = self.cache.normalize(command)
+        return key, tuple(d.casefold() for d in devices)
+    
+    def _call_llm(self, command: str) -> str:
+        # Retries happen inside the shared call, so coalesced callers wait
+        # for them instead of each retrying. The cache is filled before the
+        # in-flight call is released, so no caller can miss both
+        response = self.retry_policy.call(self._create, self._messages(command), endpoint=self.endpoint)
+        result = response.choices[0].message.content
+        self.cache.put(command, result)
+        return result
+    
+    def _create(self, messages):
+        with self.limiter.limit(estimate_tokens(messages)) as usage:
             response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": f"Process this IoT command: {command}"}]
+                model=self.MODEL,
+                messages=messages
+            )
+            usage.tokens = _total_tokens(response)
+        return response
+    
+    async def aprocess_command(self, command: str) -> str:
+        """Process IoT command without blocking the event loop."""
+        cached = self.cache.get(command)
+        if cached is not None:
+            return cached
+        return await self.async_flight.do(self._flight_key(command), self._acall_llm, command)
+    
+    async def _acall_llm(self, command: str) -> str:
+        response = await self.retry_policy.acall(self._acreate, self._messages(command), endpoint=self.endpoint)
+        result = response.choices[0].message.content
+        self.cache.put(command, result)
+        return result
+    
+    async def _acreate(self, messages):
+        async with self.limiter.alimit(estimate_tokens(messages)) as usage:
+            response = await self.async_client.chat.completions.create(
+                model=self.MODEL,
+                messages=messages
             )
-            result = response.choices[0].message.content
-            self.cache[command] = result
-            return result
+            usage.tokens = _total_tokens(response)
+        return response
+    
+    async def process_commands(
+        self,
+        commands: Union[Iterable[str], AsyncIterable[str]],
+        concurrency: int = 32,
+        ordered: bool = False,
+    ) -> AsyncIterator[Dict]:
+        """Process many commands, yielding a record per command.
+        
+        Commands are read lazily, with at most `concurrency` in flight (or,
+        when `ordered`, in flight plus finished but waiting for an earlier
+        one). Records are `{"index", "command", "result"}`, or `"error"`
+        instead of `"result"` if the command failed; they come in completion
+        order unless `ordered` is set. The limiter still paces the actual LLM
+        calls, and repeated commands are served by the cache or coalesced.
+        """
+        iterator = _async_iter(commands)
+        running = set()
+        finished: Dict[int, Dict] = {}  # ordered mode: index -> record
+        submitted = 0
+        next_index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) + len(finished) < concurrency:
+                    try:
+                        command = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    running.add(asyncio.ensure_future(self._process_one(submitted, command)))
+                    submitted += 1
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    record = task.result()
+                    if ordered:
+                        finished[record["index"]] = record
+                    else:
+                        yield record
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in running:
+                task.cancel()
+    
+    async def _process_one(self, index: int, command: str) -> Dict:
+        try:
+            return {"index": index, "command": command, "result": await self.aprocess_command(command)}
         except Exception as e:
-            return f"Error: {str(e)}"
+            return {"index": index, "command": command, "error": f"{type(e).__name__}: {e}"}
+    
+    def stats(self) -> Dict:
+        """Cache, coalescing, limiter and retry counts; the coalescing ratio
+        is the share of requests that reached the LLM path but shared
+        another caller's call."""
+        requests = self.flight.requests + self.async_flight.requests
+        executions = self.flight.executions + self.async_flight.executions
+        return {
+            "cache": self.cache.stats(),
+            "cache_hits": self.cache.hits,
+            "requests": requests,
+            "llm_calls": executions,
+            "coalesced": requests - executions,
+            "coalescing_ratio": (requests - executions) / requests if requests else 0.0,
+            "limiter": self.limiter.stats(),
+            "retries": self.retry_policy.retries,
+            "circuit": self.retry_policy.breaker(self.endpoint).stats(),
+        }
+
+
+def _total_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+async def _async_iter(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
 
 
-def main():
+async def run_batch(processor: CommandProcessor, lines: Iterable[str], output,
+                    concurrency: int = 32, ordered: bool = False) -> Dict:
+    """Process one command per non-blank line, writing JSONL records to `output`."""
+    commands = (line.strip() for line in lines if line.strip())
+    count = errors = 0
+    started = time.monotonic()
+    async for record in processor.process_commands(commands, concurrency, ordered):
+        output.write(json.dumps(record) + "\n")
+        count += 1
+        errors += "error" in record
+    output.flush()
+    return {"commands": count, "errors": errors, "seconds": time.monotonic() - started}
+
+
+def batch_main(args) -> int:
+    """Run `--batch` mode; the summary goes to stderr."""
+    processor = CommandProcessor()
+    source = sys.stdin if args.batch in (None, "-") else open(args.batch, encoding="utf-8")
+    output = sys.stdout if args.output in (None, "-") else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = asyncio.run(run_batch(processor, source, output, args.concurrency, args.ordered))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(
+        f"Processed {summary['commands']} commands ({summary['errors']} errors) "
+        f"in {summary['seconds']:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if summary["errors"] else 0
+
+
+def main(argv=None):
     """Main function."""
+    parser = argparse.ArgumentParser(description="Production Command Processor")
+    parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+                        help="process one command per line from FILE (or stdin) and write JSONL")
+    parser.add_argument("--output", metavar="FILE", help="JSONL output file (default: stdout)")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("COMMAND_BATCH_CONCURRENCY", "32")))
+    parser.add_argument("--ordered", action="store_true", help="write results in input order")
+    args = parser.parse_args(argv)
+    
+    # Piped input means batch mode
+    if args.batch is not None or not sys.stdin.isatty():
+        try:
+            return batch_main(args)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    
     print("⚙️  Production Command Processor")
     print("Type 'quit' to exit\n")
     
@@ -90,10 +334,14 @@ def main():
                 break
             result = processor.process_command(cmd)
             print(f"\nResult: {result}\n")
+        except CircuitOpenError as e:
+            print(f"\nProvider unavailable: {e}\n")
         except KeyboardInterrupt:
             print("\n\nGoodbye!")
             break
+        except Exception as e:
+            print(f"\nError: {e}\n")
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
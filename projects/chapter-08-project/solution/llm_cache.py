@@ -0,0 +1,219 @@
+"""
+Bounded response cache for LLM calls.
+
+- In-memory LRU bounded by entry count and by bytes, with a TTL per entry.
+- Optional SQLite tier (`path=...`) that survives restarts; memory misses
+  fall through to it and hits are promoted back into memory.
+- Key normalization: whitespace is collapsed and case folded, and device ids
+  ("sensor_01", "pump-7") are replaced by placeholders, so "Reboot
+  sensor_01" and "reboot  sensor_02" share one entry. Device ids in the
+  cached response are templated the same way and filled back in with the
+  requesting command's ids on a hit.
+- Hit/miss/eviction statistics.
+
+Nothing here is specific to command processing: any module that sends text
+prompts can use `LLMCache` (pass `normalizer=None` to key on the raw text).
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# A word, a separator and digits: sensor_01, device-12, pump_7
+DEFAULT_DEVICE_PATTERN = r"\b[a-z][a-z0-9]*[_-]\d+\b"
+_PLACEHOLDER_RE = re.compile(r"<device:(\d+)>")
+
+
+class KeyNormalizer:
+    """Turns prompt text into a cache key plus the device ids it contained."""
+
+    def __init__(self, device_pattern: Optional[str] = DEFAULT_DEVICE_PATTERN):
+        self.device_re = re.compile(device_pattern, re.IGNORECASE) if device_pattern else None
+
+    def normalize(self, text: str) -> Tuple[str, List[str]]:
+        """Return `(key, devices)`; `devices` are in order of first appearance,
+        as written in `text`."""
+        text = " ".join(text.split())
+        devices: List[str] = []
+        if self.device_re is not None:
+            seen: Dict[str, int] = {}
+
+            def placeholder(match):
+                device = match.group(0)
+                folded = device.casefold()
+                if folded not in seen:
+                    seen[folded] = len(devices)
+                    devices.append(device)
+                return f"<device:{seen[folded]}>"
+
+            text = self.device_re.sub(placeholder, text)
+        return text.casefold(), devices
+
+    def to_template(self, value: str, devices: List[str]) -> str:
+        """Replace whole-id matches of `devices` in `value` with placeholders,
+        in one pass, so "pump-1" never touches "pump-12"."""
+        if self.device_re is None or not devices:
+            return value
+        index = {device.casefold(): i for i, device in enumerate(devices)}
+
+        def placeholder(match):
+            i = index.get(match.group(0).casefold())
+            return match.group(0) if i is None else f"<device:{i}>"
+
+        return self.device_re.sub(placeholder, value)
+
+    def from_template(self, template: str, devices: List[str]) -> str:
+        def device(match):
+            i = int(match.group(1))
+            return devices[i] if i < len(devices) else match.group(0)
+
+        return _PLACEHOLDER_RE.sub(device, template)
+
+
+DEFAULT_NORMALIZER = KeyNormalizer()
+
+
+class LLMCache:
+    """Thread-safe LRU/TTL cache with an optional SQLite tier."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: Optional[float] = 3600.0,
+        path: Optional[str] = None,
+        normalizer: Optional[KeyNormalizer] = DEFAULT_NORMALIZER,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.normalizer = normalizer
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()  # key -> (value, expires, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+
+    def normalize(self, text: str) -> Tuple[str, List[str]]:
+        """`(key, devices)` for `text`; the key is `text` itself without a normalizer."""
+        return self.normalizer.normalize(text) if self.normalizer else (text, [])
+
+    # --- Memory tier (call with the lock held) ---------------------------------
+
+    def _remember(self, key: str, value: str, expires: float):
+        size = len(key.encode("utf-8")) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (value, expires, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _forget(self, key: str):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+
+    # --- Public API ------------------------------------------------------------
+
+    def get(self, text: str) -> Optional[str]:
+        key, devices = self.normalize(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < now:
+                self._forget(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                template = entry[0]
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or (row[1] is not None and row[1] < now):
+                    self.misses += 1
+                    return None
+                template = row[0]
+                self._remember(key, template, row[1] if row[1] is not None else float("inf"))
+                self.hits += 1
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                return None
+        return self.normalizer.from_template(template, devices) if self.normalizer else template
+
+    def put(self, text: str, value: str, ttl: Optional[float] = None):
+        """Cache `value` as the response to `text` (`ttl` overrides the default)."""
+        key, devices = self.normalize(text)
+        if self.normalizer:
+            value = self.normalizer.to_template(value, devices)
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._remember(key, value, expires)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires) VALUES (?, ?, ?)",
+                    (key, value, expires if ttl is not None else None),
+                )
+
+    def invalidate(self, text: str):
+        key = self.normalize(text)[0]
+        with self._lock:
+            self._forget(key)
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
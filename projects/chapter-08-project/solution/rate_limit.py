@@ -0,0 +1,268 @@
+"""
+Client-side rate limiting and adaptive concurrency for LLM calls.
+
+- `TokenBucket` / `RateLimiter`: requests-per-minute and tokens-per-minute
+  buckets. Callers reserve capacity up front and sleep for exactly as long
+  as the reservation needs (no polling); token estimates are corrected once
+  the response reports real usage.
+- `AdaptiveConcurrency`: AIMD limit on calls in flight. Each success adds
+  about one slot per window of `limit` calls; a 429 or a latency spike
+  (well above the running average) multiplies the limit by `backoff`, at
+  most once per typical call latency so one burst doesn't collapse it.
+- `LLMLimiter` combines both behind a context manager, and `shared_limiter`
+  returns one instance per name for the whole process, so every thread and
+  event loop calling the same provider shares the same budget.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional
+
+
+def estimate_tokens(messages: List[Dict], completion_tokens: int = 256) -> int:
+    """Rough token count for a chat request (~4 characters per token) plus
+    an allowance for the reply; corrected from `usage` afterwards."""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + completion_tokens
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    """HTTP status carried by an API error, if any."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """True for provider rate-limit/overload responses (HTTP 429 or 503)."""
+    return status_of(error) in (429, 503)
+
+
+class TokenBucket:
+    """Refills at `rate_per_minute`; holds at most `burst` (default: one
+    second's worth, at least 1)."""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take `amount` (possibly going into debt); returns seconds to wait
+        before using it. Later callers queue behind the debt."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        """Give back over-reserved tokens (or take more with a negative amount)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests/min and tokens/min limits checked together."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 burst_seconds: float = 1.0):
+        self.requests = TokenBucket(requests_per_minute, max(1.0, requests_per_minute / 60.0 * burst_seconds))
+        self.tokens = TokenBucket(tokens_per_minute, max(1.0, tokens_per_minute / 60.0 * burst_seconds))
+        self.throttled_seconds = 0.0
+
+    def reserve(self, tokens: float) -> float:
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        self.throttled_seconds += wait
+        return wait
+
+    def acquire(self, tokens: float):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float):
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on concurrent calls, shared by threads and event loops."""
+
+    def __init__(
+        self,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        warmup: int = 10,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.warmup = warmup
+        self.in_flight = 0
+        self.latency_avg: Optional[float] = None
+        self.samples = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters: deque = deque()  # (loop, future)
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while not self._has_slot():
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._has_slot():
+                    self.in_flight += 1
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """Return a slot, reporting how the call went."""
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            spike = (
+                latency is not None and self.samples >= self.warmup
+                and latency > self.latency_tolerance * self.latency_avg
+            )
+            if overloaded or spike:
+                # Multiplicative decrease, once per typical call duration
+                if now - self._last_decrease >= (self.latency_avg or 0.0):
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if latency is not None and not spike:
+                self.samples += 1
+                self.latency_avg = latency if self.latency_avg is None else 0.9 * self.latency_avg + 0.1 * latency
+            self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        if free <= 0:
+            return
+        self._cond.notify(free)
+        while free > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if not future.done():
+                loop.call_soon_threadsafe(_resolve, future)
+                free -= 1
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class CallUsage:
+    """Filled in by the caller with the tokens a response actually used."""
+
+    __slots__ = ("tokens",)
+
+    def __init__(self):
+        self.tokens: Optional[int] = None
+
+
+class LLMLimiter:
+    """Rate limits plus adaptive concurrency around each LLM call.
+
+        with limiter.limit(estimated_tokens) as usage:
+            response = client.chat.completions.create(...)
+            usage.tokens = response.usage.total_tokens
+    """
+
+    def __init__(self, requests_per_minute: float = 500, tokens_per_minute: float = 200_000,
+                 concurrency: Optional[AdaptiveConcurrency] = None):
+        self.rate = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.calls = 0
+        self.overloads = 0
+
+    def _finish(self, estimated: float, usage: CallUsage, started: float, error: Optional[BaseException]):
+        overloaded = error is not None and is_overload_error(error)
+        self.calls += 1
+        if overloaded:
+            self.overloads += 1
+        # Failures say nothing about normal latency
+        latency = time.monotonic() - started if error is None else None
+        self.concurrency.release(latency, overloaded)
+        if usage.tokens is not None:
+            self.rate.tokens.refund(estimated - usage.tokens)
+
+    @contextmanager
+    def limit(self, estimated_tokens: float):
+        self.rate.acquire(estimated_tokens)
+        self.concurrency.acquire()
+        usage = CallUsage()
+        started = time.monotonic()
+        try:
+            yield usage
+        except BaseException as e:
+            self._finish(estimated_tokens, usage, started, e)
+            raise
+        self._finish(estimated_tokens, usage, started, None)
+
+    @asynccontextmanager
+    async def alimit(self, estimated_tokens: float):
+        await self.rate.aacquire(estimated_tokens)
+        await self.concurrency.aacquire()
+        usage = CallUsage()
+        started = time.monotonic()
+        try:
+            yield usage
+        except BaseException as e:
+            self._finish(estimated_tokens, usage, started, e)
+            raise
+        self._finish(estimated_tokens, usage, started, None)
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "overloads": self.overloads,
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "limit_decreases": self.concurrency.decreases,
+            "latency_avg": self.concurrency.latency_avg,
+            "throttled_seconds": self.rate.throttled_seconds,
+        }
+
+
+_shared: Dict[str, LLMLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(name: str, **config) -> LLMLimiter:
+    """The process-wide limiter for `name` (e.g. "openai:gpt-4o-mini"),
+    created with `config` on first use."""
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = LLMLimiter(**config)
+        return _shared[name]
@@ -0,0 +1,243 @@
+"""
+Retry policy and circuit breaker for LLM calls.
+
+- Only transient failures are retried: timeouts, connection errors, 408,
+  409, 429 and 5xx. Bad requests and auth errors are raised at once.
+- Delays use decorrelated jitter (each delay is random between `base_delay`
+  and three times the previous one, capped at `max_delay`), so a fleet of
+  clients that failed together doesn't retry together.
+- A `Retry-After` / `retry-after-ms` header on the error is honoured as a
+  minimum delay.
+- No retry starts if it would end past `deadline` seconds after the first
+  attempt; the last error is raised instead.
+- With `endpoint=...`, calls go through that endpoint's process-wide
+  `CircuitBreaker`: after `failure_threshold` consecutive transient failures
+  it opens and calls fail fast with `CircuitOpenError` for `reset_timeout`
+  seconds, then one probe call decides whether it closes again.
+
+`RetryPolicy.call` sleeps with `time.sleep`; `RetryPolicy.acall` awaits
+`asyncio.sleep` and never blocks the event loop.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from rate_limit import status_of
+
+try:
+    import openai
+    TRANSIENT_TYPES = (ConnectionError, TimeoutError, asyncio.TimeoutError, openai.APIConnectionError)
+except ImportError:
+    TRANSIENT_TYPES = (ConnectionError, TimeoutError, asyncio.TimeoutError)
+
+TRANSIENT_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Circuit open for {endpoint}; retry in {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def is_transient_error(error: BaseException) -> bool:
+    if isinstance(error, TRANSIENT_TYPES):
+        return True
+    status = status_of(error)
+    return status is not None and (status in TRANSIENT_STATUSES or status >= 500)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from the error's response headers."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open after `reset_timeout`, letting one probe through."""
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        """Raise `CircuitOpenError` unless this call may go through."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            wait = self.opened_at + self.reset_timeout - now
+            # One probe at a time; a probe that never reported back expires
+            probing = self._probe_started is not None and now - self._probe_started < self.reset_timeout
+            if wait > 0 or probing:
+                self.rejected += 1
+                raise CircuitOpenError(self.endpoint, max(wait, 0.0))
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe_started is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+_BREAKER_DEFAULTS = {"failure_threshold": 5, "reset_timeout": 30.0}
+_breakers: Dict[Tuple, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint: str, **config) -> CircuitBreaker:
+    """The process-wide breaker for `endpoint` with this `config`.
+
+    Callers asking for the same endpoint and settings share one breaker;
+    different settings get their own breaker, not someone else's thresholds.
+    """
+    settings = {**_BREAKER_DEFAULTS, **config}
+    key = (endpoint, tuple(sorted(settings.items())))
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(endpoint, **settings)
+        return _breakers[key]
+
+
+class RetryPolicy:
+    """When and how long to retry a failing call."""
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        deadline: Optional[float] = 60.0,
+        retryable: Callable[[BaseException], bool] = is_transient_error,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retryable = retryable
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retries = 0
+
+    def breaker(self, endpoint: Optional[str]) -> Optional[CircuitBreaker]:
+        if endpoint is None:
+            return None
+        return circuit_breaker(endpoint, failure_threshold=self.failure_threshold,
+                               reset_timeout=self.reset_timeout)
+
+    def next_delay(self, error: BaseException, attempt: int, previous: float, started: float) -> Optional[float]:
+        """Seconds to wait before attempt `attempt + 1`, or None to give up."""
+        if attempt >= self.max_attempts or not self.retryable(error):
+            return None
+        delay = min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+        hinted = retry_after(error)
+        if hinted is not None:
+            delay = max(delay, hinted)
+        if self.deadline is not None and time.monotonic() - started + delay > self.deadline:
+            return None
+        return delay
+
+    def _record(self, breaker: Optional[CircuitBreaker], error: Optional[BaseException]):
+        if breaker is None:
+            return
+        # Errors the server answered deliberately (400, 401...) don't mean it's down
+        if error is not None and self.retryable(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def call(self, fn: Callable[..., Any], *args, endpoint: Optional[str] = None) -> Any:
+        breaker = self.breaker(endpoint)
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self._record(breaker, e)
+                delay = self.next_delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self.retries += 1
+                time.sleep(delay)
+            else:
+                self._record(breaker, None)
+                return result
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, endpoint: Optional[str] = None) -> Any:
+        breaker = self.breaker(endpoint)
+        started = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = await fn(*args)
+            except Exception as e:
+                self._record(breaker, e)
+                delay = self.next_delay(e, attempt, delay, started)
+                if delay is None:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+            else:
+                self._record(breaker, None)
+                return result
@@ -0,0 +1,97 @@
+"""
+Single-flight request coalescing.
+
+When many callers ask for the same key at once, only the first (the leader)
+runs the call; the others wait for and share its result or exception. Once
+the call finishes the key is forgotten, so later callers start a new one
+(pair this with a cache to reuse results over time).
+
+`SingleFlight` is for threads; `AsyncSingleFlight` is for coroutines on one
+event loop.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FlightStats:
+    def __init__(self):
+        self.requests = 0
+        self.executions = 0
+
+    def stats(self) -> Dict:
+        coalesced = self.requests - self.executions
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "coalesced": coalesced,
+            "coalescing_ratio": coalesced / self.requests if self.requests else 0.0,
+        }
+
+
+class SingleFlight(_FlightStats):
+    """Thread-safe single-flight group."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` unless a call for `key` is in flight, in
+        which case wait for it and return (or raise) its outcome."""
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """Single-flight group for coroutines.
+
+    The shared call runs as its own task, so a caller that is cancelled
+    doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        self.requests += 1
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = self._calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
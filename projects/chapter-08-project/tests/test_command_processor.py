@@ -1,23 +1,492 @@
 """Tests for Chapter 8 Command Processor."""
 import pytest
+import asyncio
+import json
 import sys
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
 
 try:
-    from command_processor import retry_with_backoff
+    from command_processor import retry_with_backoff, CommandProcessor, main
+    from single_flight import SingleFlight
+    from llm_cache import LLMCache
+    from rate_limit import AdaptiveConcurrency, LLMLimiter, RateLimiter, shared_limiter
+    from retry_policy import CircuitOpenError, RetryPolicy, circuit_breaker
     HAS_SOLUTION = True
 except ImportError:
     HAS_SOLUTION = False
     pytestmark = pytest.mark.skip("Solution not available")
 
 
+def _response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions; counts calls."""
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, messages):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return _response(f"done: {messages[-1]['content']}")
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, model, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return _response(f"done: {messages[-1]['content']}")
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    proc = CommandProcessor()
+    proc.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    proc.async_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions()))
+    return proc
+
+
 @pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
 def test_retry_decorator():
-    """Test retry decorator structure."""
-    # Test structure only, requires API key for full test
-    pass
+    """Only transient errors are retried; Retry-After and the deadline are honoured."""
+    calls = []
+
+    @retry_with_backoff(max_retries=3, initial_delay=0.01)
+    def flaky(status):
+        calls.append(status)
+        if len(calls) < 3:
+            raise APIError(status)
+        return "ok"
+
+    assert flaky(503) == "ok" and len(calls) == 3
+    calls.clear()
+    with pytest.raises(APIError):
+        flaky(400)
+    assert len(calls) == 1
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, deadline=0.5)
+    attempts = []
+
+    def limited():
+        attempts.append(time.monotonic())
+        raise APIError(429, retry_after="0.2" if len(attempts) == 1 else "5")
+
+    with pytest.raises(APIError):
+        policy.call(limited)
+    # Waited as asked once; the second hint would overrun the deadline
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.2
+
+    delays = [policy.next_delay(APIError(503), 1, 0.1, time.monotonic()) for _ in range(50)]
+    assert all(0.01 <= d <= 0.3 for d in delays) and len(set(delays)) > 1
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_async_retry_does_not_block_loop():
+    calls = []
+
+    @retry_with_backoff(max_retries=4, initial_delay=0.05)
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 4:
+            raise ConnectionError("reset")
+        return "ok"
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        result = await flaky()
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result == "ok" and len(calls) == 4
+    assert ticks >= 10
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_concurrent_identical_commands_share_one_call(processor):
+    results = []
+    barrier = threading.Barrier(50)
+
+    def send(command):
+        barrier.wait()
+        results.append(processor.process_command(command))
+
+    threads = [threading.Thread(target=send, args=("reboot sensor_01",)) for _ in range(50)]
+    threads.append(threading.Thread(target=lambda: results.append(processor.process_command("status"))))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert processor.client.chat.completions.calls == 2
+    assert results.count("done: Process this IoT command: reboot sensor_01") == 50
+    stats = processor.stats()
+    assert stats["requests"] + stats["cache_hits"] == 51
+    assert stats["coalescing_ratio"] > 0.9
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_async_commands_coalesce(processor):
+    async def run():
+        return await asyncio.gather(*(processor.aprocess_command("reboot") for _ in range(100)))
+
+    results = asyncio.run(run())
+
+    assert len(set(results)) == 1
+    assert processor.async_client.chat.completions.calls == 1
+    assert processor.stats()["coalesced"] == 99
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise RuntimeError("provider down")
+
+    def call():
+        try:
+            flight.do("k", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(5)]
+    for t in followers:
+        t.start()
+    while flight.requests < 6:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader, *followers]:
+        t.join()
+
+    assert len(errors) == 6
+    assert flight.stats()["executions"] == 1
+    # Nothing stays in flight after an error
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_llm_cache_normalizes_and_templates_device_ids():
+    cache = LLMCache()
+    cache.put("Reboot   sensor_01", "Rebooting sensor_01 now.")
+
+    assert cache.get("reboot sensor_01") == "Rebooting sensor_01 now."
+    # Another device shares the entry, with its own id filled in
+    assert cache.get("REBOOT Pump-7") == "Rebooting Pump-7 now."
+    assert cache.get("reboot sensor_01 twice") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_llm_cache_templates_only_whole_device_ids():
+    cache = LLMCache()
+    cache.put("compare pump-1 and sensor_1",
+              "pump-1 feeds pump-12; sensor_1 and sensor_10 disagree.")
+
+    assert cache.get("compare pump-3 and sensor_2") == (
+        "pump-3 feeds pump-12; sensor_2 and sensor_10 disagree."
+    )
+    # The request's own ids, matched case-insensitively, never other ids
+    assert cache.get("compare PUMP-12 and sensor_20") == (
+        "PUMP-12 feeds pump-12; sensor_20 and sensor_10 disagree."
+    )
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_llm_cache_bounds_ttl_and_disk_tier(tmp_path):
+    cache = LLMCache(max_entries=3, max_bytes=200, normalizer=None)
+    for i in range(5):
+        cache.put(f"k{i}", "v")
+    cache.get("k2")  # most recently used survives the next eviction
+    cache.put("big", "x" * 150)
+    assert cache.stats()["bytes"] <= 200
+    assert cache.get("k2") == "v" and cache.get("k0") is None
+    assert cache.stats()["evictions"] >= 3
+
+    cache.put("short", "lived", ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+    assert cache.stats()["expirations"] == 1
+
+    path = str(tmp_path / "cache.sqlite")
+    first = LLMCache(path=path)
+    first.put("status sensor_01", "sensor_01 is online")
+    first.close()
+    restarted = LLMCache(path=path)
+    assert restarted.get("status sensor_02") == "sensor_02 is online"
+    assert restarted.stats()["disk_hits"] == 1
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_processor_caches_across_devices(processor):
+    first = processor.process_command("reboot sensor_01")
+    second = processor.process_command("Reboot  sensor_02")
+
+    assert first == "done: Process this IoT command: reboot sensor_01"
+    assert second == "done: Process this IoT command: reboot sensor_02"
+    assert processor.client.chat.completions.calls == 1
+    assert processor.stats()["cache"]["hit_ratio"] == 0.5
+
+
+class APIError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(
+            status_code=status, headers={"retry-after": retry_after} if retry_after else {}
+        )
+
+
+class FakeLLMServer:
+    """OpenAI-compatible chat endpoint on localhost that answers 429 when
+    more than `capacity` requests are in flight, or `status` when set."""
+
+    def __init__(self, capacity=4, delay=0.05):
+        self.capacity = capacity
+        self.delay = delay
+        self.status = None
+        self.requests = 0
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake._lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    overloaded = fake.in_flight > fake.capacity
+                    if overloaded:
+                        fake.rejected += 1
+                try:
+                    if fake.status:
+                        self._reply(fake.status, {"error": {"message": "Unavailable", "type": "server_error"}})
+                        return
+                    if overloaded:
+                        self._reply(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}})
+                        return
+                    time.sleep(fake.delay)
+                    with fake._lock:
+                        fake.served += 1
+                    self._reply(200, {
+                        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                            "role": "assistant", "content": "ok: " + body["messages"][-1]["content"]}}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                    })
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def llm_server(monkeypatch):
+    server = FakeLLMServer()
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    yield server
+    server.close()
+
+
+def _run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_adaptive_concurrency_backs_off_on_429(llm_server):
+    limiter = LLMLimiter(60_000, 10_000_000, AdaptiveConcurrency(initial=16, max_limit=16))
+    # No retries, so every 429 surfaces
+    processor = CommandProcessor(limiter=limiter, retry_policy=RetryPolicy(max_attempts=1, failure_threshold=1000))
+    results = []
+
+    def send(command):
+        try:
+            results.append(processor.process_command(command))
+        except Exception as e:
+            results.append(e)
+
+    _run_threads(send, [(f"status sensor_{i}",) for i in range(60)])
+
+    stats = limiter.stats()
+    assert stats["overloads"] == llm_server.rejected > 0
+    assert stats["limit_decreases"] >= 1
+    assert stats["concurrency_limit"] < 16
+    assert stats["in_flight"] == 0
+    assert llm_server.served == sum(isinstance(r, str) for r in results)
+    # Once backed off, later calls fit the server
+    rejected = llm_server.rejected
+    _run_threads(send, [(f"reboot pump_{i}",) for i in range(20)])
+    assert llm_server.rejected - rejected < 5
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_rate_limiter_is_shared_and_paces_requests(llm_server):
+    limiter = shared_limiter("test:paced", requests_per_minute=1200, tokens_per_minute=10_000_000,
+                             concurrency=AdaptiveConcurrency(initial=4, max_limit=4))
+    first = CommandProcessor(limiter=shared_limiter("test:paced"))
+    second = CommandProcessor(limiter=shared_limiter("test:paced"))
+    assert first.limiter is second.limiter is limiter
+
+    started = time.monotonic()
+    _run_threads(lambda p, i: p.process_command(f"status device_{i}"),
+                 [(first if i % 2 else second, i) for i in range(30)])
+    # 20/s with a burst of 20: the last 10 wait about half a second
+    assert time.monotonic() - started >= 0.45
+    assert llm_server.rejected == 0
+    assert limiter.stats()["calls"] == 30
+
+    # Tokens/min: 100 tokens/s, so a second 50-token reservation waits ~0.5s
+    tokens = RateLimiter(60_000, 6000)
+    assert tokens.reserve(100) == 0
+    assert 0.45 < tokens.reserve(50) <= 0.5
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_circuit_breaker_registry_respects_config():
+    endpoint = "registry-test"
+    default = circuit_breaker(endpoint)
+    assert circuit_breaker(endpoint, failure_threshold=5) is default
+    strict = RetryPolicy(failure_threshold=1, reset_timeout=0.5).breaker(endpoint)
+    assert strict is not default
+    assert (strict.failure_threshold, strict.reset_timeout) == (1, 0.5)
+    assert RetryPolicy(failure_threshold=1, reset_timeout=0.5).breaker(endpoint) is strict
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_circuit_breaker_sheds_load_and_recovers(llm_server):
+    processor = CommandProcessor(
+        limiter=LLMLimiter(60_000, 10_000_000),
+        retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01, failure_threshold=3, reset_timeout=0.3),
+    )
+    llm_server.status = 503
+
+    with pytest.raises(Exception) as first:
+        processor.process_command("status sensor_01")
+    assert getattr(first.value, "status_code", None) == 503
+    # The third consecutive failure opens the circuit; nothing more is sent
+    for i in range(5):
+        with pytest.raises(CircuitOpenError):
+            processor.process_command(f"status sensor_{i + 2}")
+    assert llm_server.requests == 3
+    assert processor.stats()["circuit"]["state"] == "open"
+
+    llm_server.status = None
+    time.sleep(0.3)
+    assert processor.process_command("status sensor_01").startswith("ok: ")
+    assert processor.stats()["circuit"]["state"] == "closed"
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_process_commands_streams_with_bounded_concurrency(processor):
+    processor.limiter = LLMLimiter(60_000, 10_000_000, AdaptiveConcurrency(initial=64, max_limit=64))
+    completions = processor.async_client.chat.completions
+    completions.delay = 0.05
+    in_flight = peak = 0
+    create = completions.create
+
+    async def tracked(model, messages):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            if "fail" in messages[-1]["content"]:
+                raise APIError(400)
+            return await create(model, messages)
+        finally:
+            in_flight -= 1
+
+    completions.create = tracked
+
+    async def commands():
+        for i in range(200):
+            yield "fail" if i == 7 else f"status {i}"
+
+    async def collect(ordered):
+        return [r async for r in processor.process_commands(commands(), concurrency=20, ordered=ordered)]
+
+    started = time.monotonic()
+    records = asyncio.run(collect(ordered=False))
+    # 200 calls of 50ms, 20 at a time
+    assert time.monotonic() - started < 2.0
+    assert peak <= 20
+    assert len(records) == 200
+    failed = [r for r in records if "error" in r]
+    assert len(failed) == 1 and failed[0]["index"] == 7
+
+    processor.cache.clear()
+    ordered = asyncio.run(collect(ordered=True))
+    assert [r["index"] for r in ordered] == list(range(200))
+    assert ordered[3]["result"] == "done: Process this IoT command: status 3"
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_batch_cli_writes_jsonl(llm_server, tmp_path):
+    llm_server.capacity = 100
+    source = tmp_path / "commands.txt"
+    source.write_text("status sensor_01\n\nreboot pump_7\nstatus sensor_02\n")
+    output = tmp_path / "results.jsonl"
+
+    assert main(["--batch", str(source), "--output", str(output), "--ordered"]) == 0
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r["command"] for r in records] == ["status sensor_01", "reboot pump_7", "status sensor_02"]
+    assert records[1]["result"] == "ok: Process this IoT command: reboot pump_7"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+Benchmark: interactive task latency while one tenant floods the queue.
+
+A bulk tenant keeps the queue topped up (resubmitting as soon as there is
+room, as a retrying client would) with up to `flood` tasks; an interactive
+tenant meanwhile submits one task every `interval` seconds. Both go through
+a WorkerPool with the shipped default bound (QUEUE_MAXSIZE), once as a single
+FIFO (every task in the same tenant and class) and once with priority
+classes and per-tenant fair queuing. Reports how many interactive tasks were
+rejected and the p50/p99 latency (submit to completion) of the rest.
+
+Run: python benchmarks/bench_fair_queue.py [flood] [interactive] [workers]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
+
+from scalable_platform import QUEUE_MAXSIZE, WorkerPool  # noqa: E402
+
+SERVICE_SECONDS = 0.002
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(fair: bool, flood: int, interactive: int, workers: int, interval: float):
+    submitted = {}
+    latencies = []
+    rejected = 0
+    done = asyncio.Event()
+
+    async def handler(task_id):
+        await asyncio.sleep(SERVICE_SECONDS)
+        if task_id.startswith("ui"):
+            latencies.append(time.perf_counter() - submitted[task_id])
+
+    pool = WorkerPool(handler, workers=workers)
+    pool.start()
+
+    async def flooder():
+        sent = 0
+        while sent < flood and not done.is_set():
+            if fair:
+                ok = pool.submit(f"bulk{sent}", tenant="bulk-co", priority="bulk")
+            else:
+                ok = pool.submit(f"bulk{sent}")
+            if ok:
+                sent += 1
+            else:
+                await asyncio.sleep(0.001)
+
+    flooding = asyncio.create_task(flooder())
+    await asyncio.sleep(0.05)  # let the flood fill the queue
+    for i in range(interactive):
+        task_id = f"ui{i}"
+        submitted[task_id] = time.perf_counter()
+        if fair:
+            ok = pool.submit(task_id, tenant="acme", priority="interactive")
+        else:
+            ok = pool.submit(task_id)
+        rejected += not ok
+        await asyncio.sleep(interval)
+    while len(latencies) < interactive - rejected:
+        await asyncio.sleep(0.01)
+    done.set()
+    await flooding
+    await pool.stop()
+    return latencies, rejected
+
+
+def main():
+    flood = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    interactive = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    interval = 0.005
+
+    print(f"up to {flood} bulk tasks + {interactive} interactive, {workers} workers, "
+          f"{SERVICE_SECONDS * 1000:.0f}ms per task, queue bound {QUEUE_MAXSIZE}")
+    for name, fair in (("fifo", False), ("fair", True)):
+        latencies, rejected = asyncio.run(run(fair, flood, interactive, workers, interval))
+        line = f"{name:>5}: rejected {rejected:4d}/{interactive}"
+        if latencies:
+            line += (f"  p50 {statistics.median(latencies) * 1000:8.1f}ms  "
+                     f"p99 {percentile(latencies, 0.99) * 1000:8.1f}ms")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
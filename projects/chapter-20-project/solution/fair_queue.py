@@ -0,0 +1,113 @@
+"""
+Priority classes with per-tenant weighted fair queuing.
+
+Classes are served in strict priority order ("interactive" before "normal"
+before "bulk"). Within a class, tenants share the workers in proportion to
+their weights using self-clocked fair queuing: each item gets a virtual
+finish tag
+
+    finish = max(virtual_time, tenant's last finish) + 1 / weight
+
+and items are dequeued in tag order from a heap. A tenant that floods the
+queue pushes only its own tags far into the future; a newcomer's first item
+is tagged just after the current virtual time and is served almost at once.
+
+Admission is also per class: a class may only fill its share of `maxsize`,
+so the rest stays free for the classes above it and a bulk flood can't get
+interactive work rejected.
+"""
+
+import heapq
+import itertools
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+PRIORITIES = ("interactive", "normal", "bulk")
+# Fraction of `maxsize` the queue may hold when an item of the class arrives
+DEFAULT_CLASS_SHARES = {"interactive": 1.0, "normal": 0.8, "bulk": 0.5}
+
+
+class FairQueue:
+    """Bounded multi-tenant queue; push/pop are O(log n).
+
+    `maxsize` bounds the whole queue, `class_shares` how much of it lower
+    classes may fill, and `tenant_maxsize` each tenant's share, so one
+    tenant's flood can't lock the others out.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        tenant_maxsize: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+        default_weight: float = 1.0,
+        class_shares: Optional[Dict[str, float]] = None,
+    ):
+        self.maxsize = maxsize
+        self.tenant_maxsize = tenant_maxsize
+        shares = {**DEFAULT_CLASS_SHARES, **(class_shares or {})}
+        # At least one slot per class, so tiny queues still admit everything
+        self.class_limits = {p: max(1, math.ceil(maxsize * shares[p])) for p in PRIORITIES}
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self._heaps: Dict[str, List[Tuple[float, int, str, Any]]] = {p: [] for p in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._last_finish: Dict[str, Dict[str, float]] = {p: {} for p in PRIORITIES}
+        self._tenant_depth: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def depth(self, priority: str) -> int:
+        return len(self._heaps[priority])
+
+    def tenant_depth(self, tenant: str) -> int:
+        return self._tenant_depth.get(tenant, 0)
+
+    def set_weight(self, tenant: str, weight: float):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.weights[tenant] = weight
+
+    def full(self, tenant: Optional[str] = None, priority: str = "interactive") -> bool:
+        """Whether an item of `priority` from `tenant` would be refused."""
+        if self.maxsize and self._size >= self.class_limits[priority]:
+            return True
+        return bool(tenant is not None and self.tenant_maxsize
+                    and self.tenant_depth(tenant) >= self.tenant_maxsize)
+
+    def push(self, item: Any, tenant: str = "default", priority: str = "normal") -> bool:
+        """Queue `item`; False if the class's share of the queue (or the
+        tenant's) is full."""
+        if priority not in self._heaps:
+            raise ValueError(f"Unknown priority: {priority} (expected one of {', '.join(PRIORITIES)})")
+        if self.full(tenant, priority):
+            return False
+        last_finish = self._last_finish[priority]
+        start = max(self._virtual_time[priority], last_finish.get(tenant, 0.0))
+        finish = start + 1.0 / self.weights.get(tenant, self.default_weight)
+        last_finish[tenant] = finish
+        heapq.heappush(self._heaps[priority], (finish, next(self._seq), tenant, item))
+        self._tenant_depth[tenant] = self._tenant_depth.get(tenant, 0) + 1
+        self._size += 1
+        return True
+
+    def pop(self) -> Tuple[Any, str, str]:
+        """Remove the next item; returns `(item, tenant, priority)`."""
+        for priority in PRIORITIES:
+            heap = self._heaps[priority]
+            if heap:
+                finish, _, tenant, item = heapq.heappop(heap)
+                self._virtual_time[priority] = finish
+                if not heap:
+                    # Idle class: forget per-tenant tags so state doesn't grow
+                    self._virtual_time[priority] = 0.0
+                    self._last_finish[priority].clear()
+                self._tenant_depth[tenant] -= 1
+                if not self._tenant_depth[tenant]:
+                    del self._tenant_depth[tenant]
+                self._size -= 1
+                return item, tenant, priority
+        raise IndexError("pop from an empty FairQueue")
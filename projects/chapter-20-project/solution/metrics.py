@@ -0,0 +1,194 @@
+"""
+Incrementally-updated metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are updated in O(1) where events happen
+(a histogram observation is a bisect over its fixed buckets), so rendering
+costs O(number of series x buckets) no matter how many tasks have run.
+Values are per process; with several uvicorn workers, scrape each one or
+aggregate them in Prometheus.
+"""
+
+import bisect
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; suits queue waits and task runs from milliseconds to minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield `(sample name, rendered labels, value)`."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for sample, labels, value in self.samples():
+            lines.append(f"{sample}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count.
+
+    With `function`, the value is read from the callback at scrape time
+    instead (for counts another object already keeps).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self.function = function
+        self._values: Dict[LabelValues, float] = {} if labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("counters only go up")
+        self._add(amount, labels)
+
+    def _add(self, amount: float, labels: Dict[str, str]):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        if self.function is not None:
+            return float(self.function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, "", float(self.function())
+            return
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    """Value that goes up and down."""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self._add(-amount, labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution over fixed upper bounds, plus sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: [count per bucket (+Inf last), sum]
+        self._series: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def quantile(self, q: float, **labels) -> float:
+        """Upper bound of the bucket holding the q-quantile (0 if empty)."""
+        series = self._series.get(self._key(labels))
+        if not series:
+            return 0.0
+        counts = series[0]
+        target = q * sum(counts)
+        running = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            running += n
+            if running >= target and n:
+                return bound
+        return math.inf
+
+    def samples(self):
+        for key, (counts, total) in self._series.items():
+            running = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                running += n
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                yield f"{self.name}_bucket", labels, running
+            plain = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", plain, total
+            yield f"{self.name}_count", plain, running
+
+
+class Registry:
+    """Named collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (),
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, help, labelnames, function))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -3,68 +3,414 @@ Globally-Scalable IoT Platform - Complete Solution
 Chapter 20 Project
 
 Demonstrates scaling patterns: queues, caching, and horizontal scaling.
+Submitted tasks go into a bounded queue drained by a fixed pool of worker
+coroutines; when the queue is full, /tasks answers 429 with Retry-After so
+clients back off instead of piling up work. The queue serves priority
+classes in order and shares each class fairly between tenants (see
+fair_queue.py), so one tenant's bulk flood can't starve interactive requests.
+Task records live in a pluggable TaskStore (task_store.py; sharded SQLite by
+default) that survives restarts, is shared by all uvicorn workers and drops
+finished tasks after TASK_TTL_SECONDS. Metrics are counters, gauges and
+histograms updated as events happen (metrics.py), so /metrics and
+/metrics/prometheus cost the same at a thousand tasks or a billion. Status
+reads go through a versioned cache that every transition updates
+(status_cache.py), and /tasks/{id}/wait long-polls for the next change.
+The queue itself is in memory, so on startup (and with each compaction) work
+left behind by a process that has exited is re-queued, or failed if it was
+already running.
 """
 
-from fastapi import FastAPI
-from typing import Dict
+import asyncio
+import math
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Dict, Optional
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-from cachetools import TTLCache
 
-app = FastAPI(title="Scalable IoT Platform")
+from fair_queue import DEFAULT_CLASS_SHARES, FairQueue, PRIORITIES
+from metrics import Registry
+from status_cache import StatusCache
+from task_store import MemoryTaskStore, SQLiteTaskStore, TaskStore
 
 load_dotenv()
 
-# In-memory queue for demo (use Redis in production)
-task_queue = []
-task_results = {}
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "8"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "1000"))
+TASK_STORE = os.getenv("TASK_STORE", "sqlite")  # "sqlite" or "memory"
+TASK_STORE_DIR = os.getenv("TASK_STORE_DIR", os.path.join(os.path.dirname(__file__), ".task_store"))
+TASK_STORE_SHARDS = int(os.getenv("TASK_STORE_SHARDS", "8"))
+TASK_TTL_SECONDS = float(os.getenv("TASK_TTL_SECONDS", "86400"))
+COMPACT_INTERVAL_SECONDS = float(os.getenv("COMPACT_INTERVAL_SECONDS", "300"))
+STATUS_LIVE_TTL_SECONDS = float(os.getenv("STATUS_LIVE_TTL_SECONDS", "1.0"))
+WAIT_TIMEOUT_MAX_SECONDS = 60.0
+TENANT_QUEUE_MAXSIZE = int(os.getenv("TENANT_QUEUE_MAXSIZE", "0")) or None
+# e.g. "acme=3,globex=1"; unlisted tenants weigh 1
+TENANT_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (
+        pair.partition("=") for pair in os.getenv("TENANT_WEIGHTS", "").split(",") if pair.strip()
+    )
+}
+# Share of QUEUE_MAXSIZE each class may fill, e.g. "normal=0.8,bulk=0.5"
+QUEUE_CLASS_SHARES = {
+    **DEFAULT_CLASS_SHARES,
+    **{
+        name.strip(): float(share)
+        for name, _, share in (
+            pair.partition("=") for pair in os.getenv("QUEUE_CLASS_SHARES", "").split(",") if pair.strip()
+        )
+    },
+}
+TASK_PROCESSING_SECONDS = float(os.getenv("TASK_PROCESSING_SECONDS", "1.0"))
 
-# Cache for frequently accessed data
-cache = TTLCache(maxsize=1000, ttl=300)
+registry = Registry()
+TASKS_SUBMITTED = registry.counter("tasks_submitted_total", "Tasks accepted into the queue.", ["priority"])
+TASKS_REJECTED = registry.counter(
+    "tasks_rejected_total", "Submissions refused because the queue was full.", function=lambda: pool.rejected
+)
+TASKS_COMPLETED = registry.counter("tasks_completed_total", "Tasks that finished successfully.")
+TASKS_FAILED = registry.counter("tasks_failed_total", "Tasks that raised an error.")
+TASKS_QUEUED = registry.gauge("tasks_queued", "Tasks waiting in the queue.", function=lambda: pool.depth())
+TASKS_RUNNING = registry.gauge("tasks_running", "Tasks being processed.", function=lambda: pool.in_flight)
+CACHE_HITS = registry.counter(
+    "task_cache_hits_total", "Status reads served from the cache.", function=lambda: status_cache.hits
+)
+CACHE_MISSES = registry.counter(
+    "task_cache_misses_total", "Status reads that went to the task store.", function=lambda: status_cache.misses
+)
+CACHE_SIZE = registry.gauge("task_cache_size", "Entries in the status cache.", function=lambda: len(status_cache))
+QUEUE_WAIT = registry.histogram(
+    "task_queue_wait_seconds", "Time from submission until a worker picked the task up.", ["priority"]
+)
+TASK_DURATION = registry.histogram("task_processing_seconds", "Time spent processing a task.", ["priority"])
+
+
+class WorkerPool:
+    """Bounded FairQueue drained by `workers` worker coroutines.
+
+    At most `workers` tasks run at once and at most `maxsize` wait (lower
+    priority classes only up to their `class_shares` of it, and at most
+    `tenant_maxsize` per tenant). The workers bind to the running event loop
+    on first use, and are restarted if the pool is later used from a
+    different loop; queued items are kept.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers: int = WORKER_COUNT,
+        maxsize: int = QUEUE_MAXSIZE,
+        tenant_maxsize: Optional[int] = TENANT_QUEUE_MAXSIZE,
+        weights: Optional[Dict[str, float]] = None,
+        class_shares: Optional[Dict[str, float]] = None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue = FairQueue(maxsize, tenant_maxsize, weights, class_shares=class_shares)
+        self._ready: Optional[asyncio.Semaphore] = None  # counts queued items
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = []
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.service_seconds_total = 0.0
+
+    def start(self):
+        """Start the workers on the running loop (no-op if already running there)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._ready = asyncio.Semaphore(len(self.queue))
+        self._loop = loop
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self.in_flight = 0
+
+    async def stop(self):
+        """Cancel the workers; queued items stay queued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def submit(self, task_id: str, tenant: str = "default", priority: str = "normal") -> bool:
+        """Queue a task; False if the class's or the tenant's share is full.
+
+        Raises ValueError for an unknown priority.
+        """
+        self.start()
+        if not self.queue.push((task_id, time.monotonic()), tenant, priority):
+            self.rejected += 1
+            return False
+        self._ready.release()
+        return True
+
+    def can_accept(self, tenant: str = "default", priority: str = "normal") -> bool:
+        """Cheap pre-check, before any work is done for a submission."""
+        if self.queue.full(tenant, priority):
+            self.rejected += 1
+            return False
+        return True
+
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        service = self.service_seconds_total / self.processed if self.processed else TASK_PROCESSING_SECONDS
+        return max(1, math.ceil(self.depth() * service / max(self.workers, 1)))
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            (task_id, enqueued_at), _, priority = self.queue.pop()
+            started = time.monotonic()
+            wait = started - enqueued_at
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            QUEUE_WAIT.observe(wait, priority=priority)
+            self.in_flight += 1
+            try:
+                await self.handler(task_id)
+            except Exception as e:
+                print(f"Task {task_id} failed: {e}")
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                service = time.monotonic() - started
+                self.service_seconds_total += service
+                TASK_DURATION.observe(service, priority=priority)
+
+    def metrics(self) -> Dict:
+        return {
+            "queue_depth": self.depth(),
+            "queue_depth_by_priority": {p: self.queue.depth(p) for p in PRIORITIES},
+            "queue_capacity": self.maxsize,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "wait_seconds_avg": self.wait_seconds_total / self.processed if self.processed else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+def create_store() -> TaskStore:
+    if TASK_STORE == "memory":
+        return MemoryTaskStore()
+    return SQLiteTaskStore(TASK_STORE_DIR, shards=TASK_STORE_SHARDS)
+
+
+# Created on first use (normally by the lifespan), not at import
+store: Optional[TaskStore] = None
+
+
+def get_store() -> TaskStore:
+    global store
+    if store is None:
+        store = create_store()
+    return store
+
+
+async def process_task(task_id: str):
+    """Process task asynchronously."""
+    await set_status(task_id, status="running")
+    try:
+        await asyncio.sleep(TASK_PROCESSING_SECONDS)  # Simulate processing
+    except Exception as e:
+        TASKS_FAILED.inc()
+        await set_status(task_id, status="failed", error=str(e))
+        raise
+    await set_status(task_id, status="completed", completed_at=datetime.now().isoformat())
+    TASKS_COMPLETED.inc()
+
+
+# Names this process in the records it queues. The random suffix tells a
+# restarted container apart from its predecessor, which usually had the same
+# hostname and PID (often 1).
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that queued a task may still hold it in memory.
+
+    The SQLite store is local to one host, so an owner on another host (or
+    none, or in an older format) is a previous incarnation, as is one with
+    this process's own PID but another start id.
+    """
+    if owner == OWNER:
+        return True
+    host, pid, start_id = ((owner or "").rsplit(":", 2) + ["", "", ""])[:3]
+    if host != socket.gethostname() or not pid.isdigit() or not start_id:
+        return False
+    if int(pid) == os.getpid():
+        return False  # PID reused by this process after a restart
+    if os.name == "nt":
+        return True  # os.kill would terminate it; leave recovery to restarts elsewhere
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+async def recover_orphans() -> Dict[str, int]:
+    """Take over unfinished tasks whose owner has exited.
+
+    Queued tasks go back into this process's queue (failed if it is full);
+    running ones are failed, since their work may have partly happened.
+    """
+    recovered = {"requeued": 0, "failed": 0}
+    for record in await asyncio.to_thread(get_store().unfinished):
+        previous = record.get("owner")
+        if owner_alive(previous):
+            continue
+        task_id = record["task_id"]
+        if record["status"] == "queued":
+            claimed = await asyncio.to_thread(get_store().claim, task_id, OWNER, previous, status="queued")
+            if claimed is None:
+                continue  # another process got there first
+            status_cache.update(claimed)
+            if pool.submit(task_id, claimed.get("tenant", "default"), claimed.get("priority", "normal")):
+                recovered["requeued"] += 1
+                continue
+            error = "queue full when recovering the task"
+        else:
+            error = "worker exited while the task was running"
+        failed = await asyncio.to_thread(
+            get_store().claim, task_id, OWNER, OWNER if record["status"] == "queued" else previous,
+            status="failed", error=error,
+        )
+        if failed is not None:
+            status_cache.update(failed)
+            TASKS_FAILED.inc()
+            recovered["failed"] += 1
+    return recovered
+
+
+async def set_status(task_id: str, **fields):
+    """Write a transition to the store and the status cache (waking waiters)."""
+    record = await asyncio.to_thread(get_store().update, task_id, **fields)
+    if record is not None:
+        status_cache.update(record)
+
+
+async def compact_periodically():
+    """Drop finished tasks older than the TTL and recover tasks left by
+    exited workers (safe to run in every worker)."""
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL_SECONDS)
+        await recover_orphans()
+        removed = await asyncio.to_thread(get_store().compact, TASK_TTL_SECONDS)
+        if removed:
+            print(f"Compacted {removed} finished tasks")
+
+
+pool = WorkerPool(process_task, weights=TENANT_WEIGHTS, class_shares=QUEUE_CLASS_SHARES)
+
+# Read through to whichever store is current; process_task writes through
+status_cache = StatusCache(lambda task_id: get_store().get(task_id), live_ttl=STATUS_LIVE_TTL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_store()
+    pool.start()
+    recovered = await recover_orphans()
+    if any(recovered.values()):
+        print(f"Recovered tasks from exited workers: {recovered}")
+    compactor = asyncio.create_task(compact_periodically())
+    yield
+    compactor.cancel()
+    await pool.stop()
+
+
+app = FastAPI(title="Scalable IoT Platform", lifespan=lifespan)
 
 
 @app.post("/tasks")
-async def submit_task(task: Dict):
-    """Submit task to queue."""
-    task_id = f"task_{len(task_queue)}_{datetime.now().timestamp()}"
+async def submit_task(task: Dict, x_tenant_id: Optional[str] = Header(None)):
+    """Submit task to queue (429 with Retry-After when the queue is full).
+
+    The tenant comes from the X-Tenant-ID header (or the task's "tenant"
+    field) and the class from its "priority" field: "interactive",
+    "normal" (default) or "bulk".
+    """
+    tenant = x_tenant_id or str(task.get("tenant", "default"))
+    priority = task.get("priority", "normal")
+    if priority not in PRIORITIES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Unknown priority: {priority}", "priorities": list(PRIORITIES)},
+        )
+    if not pool.can_accept(tenant, priority):
+        return queue_full_response()
+    # Unique across worker processes sharing the store
+    task_id = f"task_{uuid.uuid4().hex}"
     task_item = {
         "task_id": task_id,
         "task": task,
+        "tenant": tenant,
+        "priority": priority,
         "status": "queued",
+        "owner": OWNER,
+        "version": 1,
         "created_at": datetime.now().isoformat()
     }
-    task_queue.append(task_item)
-    task_results[task_id] = task_item
-    
-    # Simulate processing
-    asyncio.create_task(process_task(task_id))
-    
+    # Stored before queuing so the worker always finds the record
+    await asyncio.to_thread(get_store().put, task_item)
+    if not pool.submit(task_id, tenant, priority):
+        # Filled up while the record was being written
+        await asyncio.to_thread(get_store().delete, task_id)
+        return queue_full_response()
+    TASKS_SUBMITTED.inc(priority=priority)
+    status_cache.update(task_item)
+
     return {"task_id": task_id, "status": "queued"}
 
 
-async def process_task(task_id: str):
-    """Process task asynchronously."""
-    await asyncio.sleep(1)  # Simulate processing
-    if task_id in task_results:
-        task_results[task_id]["status"] = "completed"
-        task_results[task_id]["completed_at"] = datetime.now().isoformat()
+def queue_full_response() -> JSONResponse:
+    retry_after = pool.retry_after()
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Task queue full", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
 
 
 @app.get("/tasks/{task_id}")
 async def get_task_status(task_id: str):
     """Get task status."""
-    # Check cache first
-    if task_id in cache:
-        return cache[task_id]
-    
-    # Get from results
-    if task_id in task_results:
-        result = task_results[task_id]
-        cache[task_id] = result
-        return result
-    
-    return {"error": "Task not found"}
+    result = await status_cache.get(task_id)
+    if result is None:
+        return {"error": "Task not found"}
+    return result
+
+
+@app.get("/tasks/{task_id}/wait")
+async def wait_for_task(task_id: str, version: Optional[int] = None, timeout: float = 30.0):
+    """Long-poll for a status change.
+
+    Returns as soon as the task's version is greater than `version` (or,
+    without `version`, once the task has finished), or the current record
+    after `timeout` seconds (capped at 60). Compare `version` to tell.
+    """
+    timeout = min(max(timeout, 0.0), WAIT_TIMEOUT_MAX_SECONDS)
+    result = await status_cache.wait(task_id, version, timeout)
+    if result is None:
+        return {"error": "Task not found"}
+    return result
 
 
 @app.get("/health")
@@ -72,23 +418,33 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "queue_size": len(task_queue),
-        "cache_size": len(cache)
+        "queue_size": pool.depth(),
+        "in_flight": pool.in_flight,
+        "cache_size": len(status_cache)
     }
 
 
 @app.get("/metrics")
 async def get_metrics():
-    """Get platform metrics."""
+    """Get platform metrics (constant cost; see /metrics/prometheus)."""
     return {
-        "tasks_queued": len(task_queue),
-        "tasks_completed": sum(1 for t in task_results.values() if t["status"] == "completed"),
-        "cache_hits": len(cache),
-        "cache_size": len(cache)
+        "tasks_queued": pool.depth(),
+        "tasks_completed": TASKS_COMPLETED.value(),
+        "tasks_failed": TASKS_FAILED.value(),
+        "cache_hits": status_cache.hits,
+        "cache_misses": status_cache.misses,
+        "cache_size": len(status_cache),
+        "wait_seconds_p99": {p: QUEUE_WAIT.quantile(0.99, priority=p) for p in PRIORITIES},
+        **pool.metrics(),
     }
 
 
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Metrics in Prometheus text exposition format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
-    import asyncio
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,105 @@
+"""
+Versioned read-through cache for task status.
+
+Reads go to the cache first and to the task store on a miss. Writers in this
+process (`update`) put the new record straight into the cache, and a cached
+copy is only ever replaced by one with a higher `version`, so a slow read
+can't overwrite a newer transition. Records written by other worker
+processes are picked up once a live (unfinished) entry is older than
+`live_ttl`; finished records never change and stay until evicted.
+
+`wait` lets a client block until a task moves past a version (long-poll)
+instead of polling: updates in this process wake waiters at once, and
+changes from other processes are noticed within `live_ttl`.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+from cachetools import LRUCache
+
+from task_store import TERMINAL_STATUSES
+
+
+class StatusCache:
+    """LRU of `task_id -> (record, fetched_at)` with change notification."""
+
+    def __init__(self, load: Callable[[str], Optional[Dict]], maxsize: int = 10_000, live_ttl: float = 1.0):
+        self._load = load
+        self.live_ttl = live_ttl
+        self._entries = LRUCache(maxsize=maxsize)
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _fresh(self, entry) -> bool:
+        record, fetched_at = entry
+        return record["status"] in TERMINAL_STATUSES or time.monotonic() - fetched_at < self.live_ttl
+
+    def update(self, record: Dict) -> Dict:
+        """Offer a record; returns whichever copy is newest."""
+        task_id = record["task_id"]
+        current = self._entries.get(task_id)
+        if current is not None:
+            if current[0].get("version", 0) > record.get("version", 0):
+                return current[0]
+            changed = record.get("version", 0) > current[0].get("version", 0)
+        else:
+            changed = True
+        self._entries[task_id] = (record, time.monotonic())
+        if changed:
+            event = self._events.pop(task_id, None)
+            if event is not None:
+                event.set()
+        return record
+
+    def invalidate(self, task_id: str):
+        self._entries.pop(task_id, None)
+
+    async def get(self, task_id: str) -> Optional[Dict]:
+        entry = self._entries.get(task_id)
+        if entry is not None and self._fresh(entry):
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        record = await asyncio.to_thread(self._load, task_id)
+        if record is None:
+            self.invalidate(task_id)
+            return None
+        return self.update(record)
+
+    async def wait(self, task_id: str, after_version: Optional[int] = None, timeout: float = 30.0) -> Optional[Dict]:
+        """Return the record once its version exceeds `after_version` (or,
+        with None, once the task has finished), or the current record when
+        `timeout` expires. None if the task doesn't exist."""
+        deadline = time.monotonic() + timeout
+        while True:
+            record = await self.get(task_id)
+            if record is None or record["status"] in TERMINAL_STATUSES:
+                return record
+            if after_version is not None and record.get("version", 0) > after_version:
+                return record
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return record
+            event = self._events.setdefault(task_id, asyncio.Event())
+            self._waiters[task_id] = self._waiters.get(task_id, 0) + 1
+            try:
+                # Wake on a local update, or re-read once the entry goes stale
+                await asyncio.wait_for(event.wait(), min(remaining, self.live_ttl))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters[task_id] -= 1
+                if not self._waiters[task_id]:
+                    del self._waiters[task_id]
+                    if self._events.get(task_id) is event:
+                        del self._events[task_id]
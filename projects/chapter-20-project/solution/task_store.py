@@ -0,0 +1,262 @@
+"""
+Task record storage for the scalable platform.
+
+`SQLiteTaskStore` is the durable default: records live in `shards` SQLite
+files (WAL mode), chosen by a stable CRC32 of the task id, so writes to
+different tasks rarely contend for the same lock and several uvicorn worker
+processes can share one directory. `MemoryTaskStore` keeps everything in a
+dict for tests and single-process demos.
+
+Finished tasks (completed or failed) are deleted by `compact(ttl_seconds)`
+once they are older than the TTL, so storage stays bounded. Unfinished
+records name the process that queued them in `owner`; `unfinished()` and
+`claim()` let another process take over (or fail) those whose owner died.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class TaskStore:
+    """Interface for task record storage. Records are JSON-serializable dicts
+    with at least `task_id` and `status`.
+
+    Every record carries a `version`: `put` starts it at 1 (unless given) and
+    each `update` increments it, so readers can tell which copy is newer.
+    """
+
+    def put(self, task: Dict) -> None:
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def update(self, task_id: str, **fields) -> Optional[Dict]:
+        """Merge `fields` into a record; returns the new record (None if missing)."""
+        raise NotImplementedError
+
+    def claim(self, task_id: str, owner: str, previous_owner: Optional[str], **fields) -> Optional[Dict]:
+        """Like `update`, also setting `owner`, but only if the record still
+        belongs to `previous_owner` (None if it doesn't, or is missing)."""
+        raise NotImplementedError
+
+    def unfinished(self) -> List[Dict]:
+        """All records not in a terminal status."""
+        raise NotImplementedError
+
+    def delete(self, task_id: str) -> None:
+        raise NotImplementedError
+
+    def count(self, status: str) -> int:
+        raise NotImplementedError
+
+    def compact(self, ttl_seconds: float) -> int:
+        """Delete finished tasks last updated more than `ttl_seconds` ago."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """Process-local store (not shared between workers, lost on restart)."""
+
+    def __init__(self):
+        self._tasks: Dict[str, Dict] = {}
+        self._updated: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def put(self, task: Dict) -> None:
+        with self._lock:
+            self._tasks[task["task_id"]] = {"version": 1, **task}
+            self._updated[task["task_id"]] = time.time()
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        task = self._tasks.get(task_id)
+        return dict(task) if task is not None else None
+
+    def update(self, task_id: str, **fields) -> Optional[Dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            task.update(fields)
+            task["version"] = task.get("version", 0) + 1
+            self._updated[task_id] = time.time()
+            return dict(task)
+
+    def claim(self, task_id: str, owner: str, previous_owner: Optional[str], **fields) -> Optional[Dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.get("owner") != previous_owner:
+                return None
+            return self.update(task_id, owner=owner, **fields)
+
+    def unfinished(self) -> List[Dict]:
+        return [dict(t) for t in list(self._tasks.values()) if t["status"] not in TERMINAL_STATUSES]
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._updated.pop(task_id, None)
+
+    def count(self, status: str) -> int:
+        return sum(1 for t in self._tasks.values() if t["status"] == status)
+
+    def compact(self, ttl_seconds: float) -> int:
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            expired = [
+                task_id for task_id, task in self._tasks.items()
+                if task["status"] in TERMINAL_STATUSES and self._updated[task_id] < cutoff
+            ]
+            for task_id in expired:
+                del self._tasks[task_id]
+                del self._updated[task_id]
+        return len(expired)
+
+
+class SQLiteTaskStore(TaskStore):
+    """Durable store sharded over `shards` SQLite files in `directory`.
+
+    The shard count must stay the same for the life of the directory (it is
+    recorded on first use and checked afterwards).
+    """
+
+    def __init__(self, directory: str, shards: int = 8, timeout: float = 30.0):
+        self.directory = directory
+        self.shards = shards
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+        self._check_layout()
+        self._local = threading.local()
+        for shard in range(shards):
+            self._connection(shard).execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY, status TEXT NOT NULL,"
+                " data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._connection(shard).execute(
+                "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, updated_at)"
+            )
+
+    def _check_layout(self):
+        path = os.path.join(self.directory, "store.json")
+        try:
+            with open(path, "x", encoding="utf-8") as f:
+                json.dump({"shards": self.shards}, f)
+        except FileExistsError:
+            with open(path, encoding="utf-8") as f:
+                existing = json.load(f)["shards"]
+            if existing != self.shards:
+                raise ValueError(f"{self.directory} holds {existing} shards, not {self.shards}")
+
+    def shard_of(self, task_id: str) -> int:
+        # Stable across processes (unlike hash(), which is salted per process)
+        return zlib.crc32(task_id.encode("utf-8")) % self.shards
+
+    def _connection(self, shard: int) -> sqlite3.Connection:
+        # One connection per thread and shard; autocommit, explicit transactions
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(shard)
+        if conn is None:
+            conn = sqlite3.connect(
+                os.path.join(self.directory, f"tasks-{shard:03d}.sqlite"),
+                timeout=self.timeout,
+                isolation_level=None,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            connections[shard] = conn
+        return conn
+
+    def put(self, task: Dict) -> None:
+        task = {"version": 1, **task}
+        self._connection(self.shard_of(task["task_id"])).execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+            (task["task_id"], task["status"], json.dumps(task), time.time()),
+        )
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        row = self._connection(self.shard_of(task_id)).execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id: str, **fields) -> Optional[Dict]:
+        return self._update(task_id, fields)
+
+    def claim(self, task_id: str, owner: str, previous_owner: Optional[str], **fields) -> Optional[Dict]:
+        return self._update(task_id, {**fields, "owner": owner}, check_owner=True, previous_owner=previous_owner)
+
+    def _update(self, task_id: str, fields: Dict, check_owner: bool = False,
+                previous_owner: Optional[str] = None) -> Optional[Dict]:
+        conn = self._connection(self.shard_of(task_id))
+        # IMMEDIATE takes the write lock up front, so concurrent read-modify-
+        # writes from other processes serialize instead of losing updates
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            task = json.loads(row[0]) if row else None
+            if task is None or (check_owner and task.get("owner") != previous_owner):
+                conn.execute("COMMIT")
+                return None
+            task.update(fields)
+            task["version"] = task.get("version", 0) + 1
+            conn.execute(
+                "UPDATE tasks SET status = ?, data = ?, updated_at = ? WHERE task_id = ?",
+                (task["status"], json.dumps(task), time.time(), task_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return task
+
+    def unfinished(self) -> List[Dict]:
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        return [
+            json.loads(data)
+            for shard in range(self.shards)
+            for (data,) in self._connection(shard).execute(
+                f"SELECT data FROM tasks WHERE status NOT IN ({placeholders})", TERMINAL_STATUSES
+            )
+        ]
+
+    def delete(self, task_id: str) -> None:
+        self._connection(self.shard_of(task_id)).execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def count(self, status: str) -> int:
+        return sum(
+            self._connection(shard).execute(
+                "SELECT COUNT(*) FROM tasks WHERE status = ?", (status,)
+            ).fetchone()[0]
+            for shard in range(self.shards)
+        )
+
+    def compact(self, ttl_seconds: float) -> int:
+        cutoff = time.time() - ttl_seconds
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        removed = 0
+        for shard in range(self.shards):
+            cursor = self._connection(shard).execute(
+                f"DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*TERMINAL_STATUSES, cutoff),
+            )
+            removed += cursor.rowcount
+        return removed
+
+    def close(self) -> None:
+        """Close the calling thread's connections."""
+        for conn in getattr(self._local, "connections", {}).values():
+            conn.close()
+        self._local.connections = {}
@@ -3,17 +3,30 @@ import pytest
 from fastapi.testclient import TestClient
 import sys
 import os
+import time
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
 
 try:
-    from scalable_platform import app
+    import scalable_platform
+    from scalable_platform import app, WorkerPool
+    from fair_queue import FairQueue
+    from task_store import SQLiteTaskStore, MemoryTaskStore
+    from metrics import Registry
     HAS_SOLUTION = True
 except ImportError:
     HAS_SOLUTION = False
     pytestmark = pytest.mark.skip("Solution not available")
 
 
+@pytest.fixture(autouse=True)
+def task_store_dir(monkeypatch, tmp_path):
+    """Keep the default SQLite store out of the source tree."""
+    if HAS_SOLUTION:
+        monkeypatch.setattr(scalable_platform, "TASK_STORE_DIR", str(tmp_path / "task_store"))
+        monkeypatch.setattr(scalable_platform, "store", None)
+
+
 @pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
 def test_submit_task():
     """Test task submission."""
@@ -32,5 +45,259 @@ def test_health_check():
     assert response.json()["status"] == "healthy"
 
 
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_full_queue_returns_429(monkeypatch):
+    """A full queue sheds load with 429 and Retry-After."""
+    # No workers, so nothing drains
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=0, maxsize=2))
+    monkeypatch.setattr(scalable_platform, "store", MemoryTaskStore())
+    with TestClient(app) as client:
+        accepted = [client.post("/tasks", json={"n": i}) for i in range(2)]
+        rejected = client.post("/tasks", json={"n": 2})
+        metrics = client.get("/metrics").json()
+
+    assert all(r.status_code == 200 for r in accepted)
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert metrics["queue_depth"] == 2
+    assert metrics["rejected"] == 1
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_worker_pool_caps_concurrency(monkeypatch):
+    """Workers drain the queue with at most `workers` tasks in flight."""
+    peak = 0
+
+    async def handler(task_id):
+        nonlocal peak
+        peak = max(peak, scalable_platform.pool.in_flight)
+        await scalable_platform.asyncio.sleep(0.02)
+
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(handler, workers=2, maxsize=100))
+    monkeypatch.setattr(scalable_platform, "store", MemoryTaskStore())
+    with TestClient(app) as client:
+        for i in range(10):
+            assert client.post("/tasks", json={"n": i}).status_code == 200
+        deadline = time.time() + 5
+        while client.get("/metrics").json()["processed"] < 10 and time.time() < deadline:
+            time.sleep(0.02)
+        metrics = client.get("/metrics").json()
+
+    assert metrics["processed"] == 10
+    assert metrics["in_flight"] == 0
+    assert peak == 2
+    assert metrics["wait_seconds_max"] > 0
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_fair_queue_priorities_and_tenant_shares():
+    queue = FairQueue(weights={"gold": 2})
+    for i in range(100):
+        queue.push(f"flood{i}", tenant="bulk-co", priority="bulk")
+    for i in range(6):
+        queue.push(f"a{i}", tenant="acme")
+        queue.push(f"g{i}", tenant="gold")
+    queue.push("click", tenant="acme", priority="interactive")
+
+    order = [queue.pop()[0] for _ in range(10)]
+    assert order[0] == "click"  # interactive goes first
+    # Weighted 2:1 in the normal class; the bulk flood waits for both
+    assert order[1:10] == ["g0", "a0", "g1", "g2", "a1", "g3", "g4", "a2", "g5"]
+    assert len(queue) == 103
+
+    capped = FairQueue(maxsize=10, tenant_maxsize=2)
+    assert capped.push(1, tenant="t") and capped.push(2, tenant="t")
+    assert not capped.push(3, tenant="t")
+    assert capped.push(4, tenant="other")
+    with pytest.raises(ValueError):
+        capped.push(5, priority="urgent")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_bulk_flood_leaves_room_for_interactive():
+    queue = FairQueue(maxsize=1000)
+    accepted = sum(queue.push(i, tenant="bulk-co", priority="bulk") for i in range(1000))
+    assert accepted == 500
+    assert queue.full("ui", "bulk") and not queue.full("ui", "interactive")
+    assert queue.push("click", tenant="ui", priority="interactive")
+    assert sum(queue.push(i, tenant="acme") for i in range(1000)) == 299
+    assert queue.push("click2", tenant="ui", priority="interactive")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_submit_task_priority_and_tenant(monkeypatch):
+    monkeypatch.setattr(scalable_platform, "store", MemoryTaskStore())
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=0))
+    with TestClient(app) as client:
+        ok = client.post("/tasks", json={"priority": "interactive"}, headers={"X-Tenant-ID": "acme"})
+        bad = client.post("/tasks", json={"priority": "urgent"})
+        status = client.get(f"/tasks/{ok.json()['task_id']}").json()
+        metrics = client.get("/metrics").json()
+
+    assert ok.status_code == 200
+    assert bad.status_code == 400
+    assert (status["tenant"], status["priority"]) == ("acme", "interactive")
+    assert metrics["queue_depth_by_priority"]["interactive"] == 1
+
+
+def _put_tasks(directory, prefix, n):
+    store = SQLiteTaskStore(directory, shards=4)
+    for i in range(n):
+        store.put({"task_id": f"{prefix}{i}", "status": "queued"})
+        store.update(f"{prefix}{i}", status="completed")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_sqlite_task_store_shared_and_compacted(tmp_path):
+    import multiprocessing
+
+    directory = str(tmp_path / "store")
+    store = SQLiteTaskStore(directory, shards=4)
+    # Several worker processes writing to the same store
+    processes = [
+        multiprocessing.Process(target=_put_tasks, args=(directory, f"w{w}-", 50)) for w in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+
+    assert store.count("completed") == 150
+    assert store.get("w1-7") == {"task_id": "w1-7", "status": "completed", "version": 2}
+    assert len({store.shard_of(f"w0-{i}") for i in range(50)}) == 4
+
+    store.put({"task_id": "live", "status": "running"})
+    assert store.compact(ttl_seconds=3600) == 0
+    assert store.compact(ttl_seconds=0) == 150  # running tasks are kept
+    assert store.get("live")["status"] == "running"
+
+    with pytest.raises(ValueError):
+        SQLiteTaskStore(directory, shards=8)  # would re-shard existing data
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_startup_recovers_tasks_of_exited_workers(monkeypatch, tmp_path):
+    store = SQLiteTaskStore(str(tmp_path / "store"), shards=2)
+    dead = "old-host:123"  # a previous container
+    store.put({"task_id": "q1", "status": "queued", "owner": dead, "tenant": "acme", "priority": "bulk"})
+    store.put({"task_id": "r1", "status": "running", "owner": dead})
+    # Same hostname and PID as this process, from before a container restart
+    restarted = f"{scalable_platform.socket.gethostname()}:{os.getpid()}:0ld5tart"
+    store.put({"task_id": "r2", "status": "running", "owner": restarted})
+    sibling = f"{scalable_platform.socket.gethostname()}:{os.getppid()}:51b1ing"
+    store.put({"task_id": "theirs", "status": "running", "owner": sibling})
+    store.put({"task_id": "legacy", "status": "queued"})
+    store.put({"task_id": "mine", "status": "queued", "owner": scalable_platform.OWNER})
+    store.put({"task_id": "done", "status": "completed", "owner": dead})
+    monkeypatch.setattr(scalable_platform, "store", store)
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=0))
+    scalable_platform.status_cache.clear()
+
+    with TestClient(app) as client:
+        depth = scalable_platform.pool.queue.depth("bulk")
+        failed = client.get("/tasks/r1/wait", params={"timeout": 5}).json()
+        metrics = client.get("/metrics").json()
+
+    assert depth == 1 and metrics["queue_depth"] == 2  # q1 and legacy
+    assert store.get("q1")["owner"] == scalable_platform.OWNER
+    assert failed["status"] == "failed" and "exited" in failed["error"]
+    assert store.get("r2")["status"] == "failed"
+    assert store.get("mine")["version"] == 1  # a live owner's task is left alone
+    assert store.get("theirs")["version"] == 1
+    assert store.get("done")["owner"] == dead
+    assert [t["task_id"] for t in store.unfinished() if t["owner"] != scalable_platform.OWNER] == ["theirs"]
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_status_cache_sees_other_workers_updates(monkeypatch):
+    store = MemoryTaskStore()
+    monkeypatch.setattr(scalable_platform, "store", store)
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=0))
+    monkeypatch.setattr(scalable_platform.status_cache, "live_ttl", 0.05)
+    with TestClient(app) as client:
+        task_id = client.post("/tasks", json={"n": 1}).json()["task_id"]
+        assert client.get(f"/tasks/{task_id}").json()["status"] == "queued"
+        store.update(task_id, status="completed")  # e.g. by another worker process
+        time.sleep(0.06)
+        record = client.get(f"/tasks/{task_id}").json()
+
+    assert (record["status"], record["version"]) == ("completed", 2)
+    # An older copy never replaces a newer one
+    stale = {**record, "status": "queued", "version": 1}
+    assert scalable_platform.status_cache.update(stale)["status"] == "completed"
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_wait_endpoint_long_polls(monkeypatch):
+    monkeypatch.setattr(scalable_platform, "store", MemoryTaskStore())
+    monkeypatch.setattr(scalable_platform, "TASK_PROCESSING_SECONDS", 0.2)
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=1))
+    with TestClient(app) as client:
+        task_id = client.post("/tasks", json={"n": 1}).json()["task_id"]
+        start = time.perf_counter()
+        done = client.get(f"/tasks/{task_id}/wait", params={"timeout": 5}).json()
+        elapsed = time.perf_counter() - start
+        timed_out = client.get(f"/tasks/{task_id}/wait", params={"version": 3, "timeout": 0.05}).json()
+        missing = client.get("/tasks/nope/wait", params={"timeout": 0.05}).json()
+
+    assert done["status"] == "completed"
+    assert done["version"] == 3  # queued -> running -> completed
+    assert elapsed < 1.0  # woken by the update, not a poll loop
+    assert timed_out["version"] == 3
+    assert missing == {"error": "Task not found"}
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_metrics_registry_prometheus_format():
+    registry = Registry()
+    done = registry.counter("done_total", "Done.", ["priority"])
+    depth = registry.gauge("depth", "Depth.", function=lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+    done.inc(priority="bulk")
+    done.inc(2, priority="bulk")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value)
+    text = registry.render()
+
+    assert "# TYPE done_total counter" in text
+    assert 'done_total{priority="bulk"} 3' in text
+    assert "depth 7" in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text  # buckets are cumulative
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_count 4" in text
+    assert latency.quantile(0.5) == 1.0
+
+    # Rendering cost doesn't grow with the number of events
+    for _ in range(10_000):
+        latency.observe(0.2)
+        done.inc(priority="bulk")
+    assert len(registry.render().splitlines()) == len(text.splitlines())
+    with pytest.raises(ValueError):
+        done.inc(-1, priority="bulk")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_prometheus_endpoint_counts_cache_hits(monkeypatch):
+    monkeypatch.setattr(scalable_platform, "store", MemoryTaskStore())
+    monkeypatch.setattr(scalable_platform, "pool", WorkerPool(scalable_platform.process_task, workers=0))
+    with TestClient(app) as client:
+        before = client.get("/metrics").json()
+        task_id = client.post("/tasks", json={"priority": "bulk"}).json()["task_id"]
+        scalable_platform.store.update(task_id, status="completed")
+        scalable_platform.status_cache.invalidate(task_id)
+        for _ in range(3):
+            client.get(f"/tasks/{task_id}")
+        client_metrics = client.get("/metrics").json()
+        response = client.get("/metrics/prometheus")
+
+    assert client_metrics["cache_misses"] - before["cache_misses"] == 1
+    assert client_metrics["cache_hits"] - before["cache_hits"] == 2
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "tasks_queued 1" in response.text
+    assert 'tasks_submitted_total{priority="bulk"}' in response.text
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
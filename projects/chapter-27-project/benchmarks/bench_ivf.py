@@ -0,0 +1,63 @@
+"""
+Benchmark: IVF recall/latency trade-off against exact search.
+
+Builds a clustered synthetic corpus, then reports recall@10 and mean query
+latency for several `nprobe` values next to the exact (brute-force) index.
+
+Run: python benchmarks/bench_ivf.py [n_vectors] [dims]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
+
+from vector_store import ExactIndex, IVFIndex  # noqa: E402
+
+
+def make_corpus(n: int, dims: int, n_topics: int = 20_000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dims)).astype(np.float32)
+    data = topics[rng.integers(0, n_topics, size=n)] + 0.6 * rng.normal(size=(n, dims)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def timed_search(index, queries, top_k, **kwargs):
+    start = time.perf_counter()
+    results = [{row for row, _ in index.search(q, top_k=top_k, **kwargs)} for q in queries]
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    dims = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    top_k = 10
+    data = make_corpus(n, dims)
+    rng = np.random.default_rng(1)
+    queries = data[rng.choice(n, size=200, replace=False)] + 0.05 * rng.normal(size=(200, dims))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    exact = ExactIndex()
+    exact.add(data)
+    truth, exact_latency = timed_search(exact, queries, top_k)
+
+    n_lists = int(np.sqrt(n) * 2)
+    ivf = IVFIndex(n_lists=n_lists)
+    ivf.add(data)
+    start = time.perf_counter()
+    ivf.train()
+    print(f"{n} vectors x {dims} dims, {n_lists} lists (train {time.perf_counter() - start:.1f}s)")
+    print(f"{'backend':<14}{'recall@10':>10}{'ms/query':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{exact_latency * 1000:>10.2f}")
+
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        found, latency = timed_search(ivf, queries, top_k, nprobe=nprobe)
+        recall = np.mean([len(t & f) / top_k for t, f in zip(truth, found)])
+        print(f"{'ivf nprobe=' + str(nprobe):<14}{recall:>10.3f}{latency * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
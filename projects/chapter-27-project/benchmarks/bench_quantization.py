@@ -0,0 +1,54 @@
+"""
+Benchmark: memory per vector and recall@10 for compressed vector stores.
+
+Compares float32 (ExactIndex) with the configurations RAGSystem ships:
+8-bit scalar quantization, and product quantization with its default code
+size and shortlist re-ranking (exact float32 copies on disk). PQ codes alone
+(rerank=0) are listed to show what the re-rank recovers.
+
+Run: python benchmarks/bench_quantization.py [n_vectors] [dims]
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
+
+from vector_store import ExactIndex, QuantizedIndex  # noqa: E402
+from bench_ivf import make_corpus, timed_search  # noqa: E402
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    dims = int(sys.argv[2]) if len(sys.argv) > 2 else 1536
+    top_k = 10
+    data = make_corpus(n, dims)
+    rng = np.random.default_rng(1)
+    queries = data[rng.choice(n, size=100, replace=False)] + 0.05 * rng.normal(size=(100, dims))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    exact = ExactIndex()
+    exact.add(data)
+    truth, latency = timed_search(exact, queries, top_k)
+    print(f"{n} vectors x {dims} dims")
+    print(f"{'store':<14}{'RAM B/vec':>10}{'disk B/vec':>11}{'GB RAM per 10M':>16}{'recall@10':>11}{'ms/query':>10}")
+    print(f"{'float32':<14}{4 * dims:>10}{0:>11}{4 * dims * 1e7 / 1e9:>16.1f}{1.0:>11.3f}{latency * 1000:>10.2f}")
+
+    for label, kwargs in [
+        ("int8", {"quantization": "int8"}),
+        ("pq (default)", {"quantization": "pq"}),
+        ("pq codes only", {"quantization": "pq", "rerank": 0}),
+    ]:
+        index = QuantizedIndex(min_train_points=n, max_train_points=10_000, **kwargs)
+        index.add(data)
+        found, latency = timed_search(index, queries, top_k)
+        recall = np.mean([len(t & f) / top_k for t, f in zip(truth, found)])
+        size = index.bytes_per_vector
+        disk = 4 * dims if index.rerank else 0
+        print(f"{label:<14}{size:>10}{disk:>11}{size * 1e7 / 1e9:>16.2f}{recall:>11.3f}{latency * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
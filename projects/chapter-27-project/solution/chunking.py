@@ -0,0 +1,151 @@
+"""
+Token-aware streaming chunker for RAG indexing.
+
+Text is split on paragraph and sentence boundaries, and sentences are packed
+into chunks of at most `max_tokens` tokens with `overlap_tokens` of trailing
+context repeated at the start of the next chunk. Input may be a string or any
+iterable of text pieces (e.g. an open file), and chunks are yielded as soon as
+they are complete, so large manuals never have to be loaded in full.
+"""
+
+import math
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str = "cl100k_base"):
+    """Load a tiktoken encoding once per process."""
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text: str) -> int:
+    """Token count with the cached cl100k encoder (~4 chars/token fallback)."""
+    if tiktoken:
+        return len(_get_encoding().encode(text))
+    return max(1, math.ceil(len(text) / 4))
+
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_paragraph(paragraph: str) -> Iterator[str]:
+    for sentence in _SENTENCE_END.split(paragraph.strip()):
+        sentence = " ".join(sentence.split())
+        if sentence:
+            yield sentence
+
+
+def iter_sentences(
+    source: Union[str, Iterable[str]], max_buffer_chars: int = 1 << 16
+) -> Iterator[Tuple[str, bool]]:
+    """Yield `(sentence, starts_paragraph)` pairs from a string or text stream.
+
+    Only complete paragraphs are split; the unfinished tail stays buffered
+    until more input arrives. A paragraph longer than `max_buffer_chars` is
+    split at its last sentence boundary to bound memory.
+    """
+    if isinstance(source, str):
+        source = (source,)
+    buffer = ""
+    content_end = 0  # end of the last non-whitespace text in `buffer`
+    new_paragraph = True
+    for piece in source:
+        scan_from = content_end
+        stripped = piece.rstrip()
+        if stripped:
+            content_end = len(buffer) + len(stripped)
+        buffer += piece
+        # A paragraph break can only appear after the previous content end
+        if _PARAGRAPH_BREAK.search(buffer, scan_from):
+            parts = _PARAGRAPH_BREAK.split(buffer)
+            buffer = parts.pop()
+            content_end = len(buffer.rstrip())
+            for paragraph in parts:
+                for i, sentence in enumerate(_split_paragraph(paragraph)):
+                    yield sentence, new_paragraph and i == 0
+                new_paragraph = True
+        if len(buffer) > max_buffer_chars:
+            # Flush up to the last sentence boundary, keeping the raw tail
+            # (with its whitespace) so the next piece joins it as written
+            last = None
+            for last in _SENTENCE_END.finditer(buffer):
+                pass
+            cut = last.start() if last is not None else len(buffer)
+            head, buffer = buffer[:cut], buffer[cut:]
+            content_end = len(buffer.rstrip())
+            for i, sentence in enumerate(_split_paragraph(head)):
+                yield sentence, new_paragraph and i == 0
+                new_paragraph = False
+    for i, sentence in enumerate(_split_paragraph(buffer)):
+        yield sentence, new_paragraph and i == 0
+
+
+def _split_long(sentence: str, max_tokens: int, count: Callable[[str], int]) -> Iterator[str]:
+    """Hard-split a sentence that alone exceeds the budget, on word boundaries."""
+    words, used = [], 0
+    for word in sentence.split():
+        tokens = count(word) + (1 if words else 0)
+        if words and used + tokens > max_tokens:
+            yield " ".join(words)
+            words, used = [], 0
+            tokens = count(word)
+        words.append(word)
+        used += tokens
+    if words:
+        yield " ".join(words)
+
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_tokens: int = 256,
+    overlap_tokens: int = 32,
+    count: Callable[[str], int] = count_tokens,
+) -> Iterator[str]:
+    """Yield chunks of whole sentences, each at most about `max_tokens` tokens.
+
+    Consecutive chunks share up to `overlap_tokens` tokens of trailing
+    sentences. Paragraph breaks inside a chunk are preserved as blank lines.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+
+    window: deque = deque()  # (sentence, tokens, starts_paragraph)
+    total = 0
+    fresh = False  # window holds sentences not yet emitted
+
+    def render() -> str:
+        out = []
+        for i, (sentence, _, starts_paragraph) in enumerate(window):
+            if i:
+                out.append("\n\n" if starts_paragraph else " ")
+            out.append(sentence)
+        return "".join(out)
+
+    for sentence, starts_paragraph in iter_sentences(source):
+        pieces = [sentence]
+        if count(sentence) > max_tokens:
+            pieces = list(_split_long(sentence, max_tokens, count))
+        for j, piece in enumerate(pieces):
+            tokens = count(piece)
+            if window and total + tokens > max_tokens:
+                if fresh:
+                    yield render()
+                    fresh = False
+                # Keep only the trailing sentences that fit in the overlap
+                while window and (total > overlap_tokens or total + tokens > max_tokens):
+                    total -= window.popleft()[1]
+            window.append((piece, tokens, starts_paragraph and j == 0))
+            total += tokens
+            fresh = True
+    if fresh:
+        yield render()
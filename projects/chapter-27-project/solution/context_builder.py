@@ -0,0 +1,99 @@
+"""
+Token-budgeted context assembly for RAG prompts.
+
+Retrieved chunks often overlap (chunk overlap, repeated boilerplate, the same
+passage in several documents). ContextBuilder:
+1. selects chunks with maximal marginal relevance (MMR) and drops any chunk
+   whose similarity to an already selected one exceeds a threshold,
+2. packs the survivors into an explicit token budget, preferring the best
+   relevance per token,
+3. orders the packed chunks by relevance for the prompt,
+and reports how many tokens that saved compared with sending every candidate.
+"""
+
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from chunking import count_tokens
+
+
+class ContextBuilder:
+    """Deduplicate, budget and order retrieved chunks."""
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        duplicate_threshold: float = 0.92,
+        mmr_lambda: float = 0.7,
+        count: Callable[[str], int] = count_tokens,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+        self.count = count
+
+    def build(
+        self,
+        query_embedding: Sequence[float],
+        chunks: Sequence[str],
+        embeddings: np.ndarray,
+    ) -> Dict:
+        """Assemble context from candidate chunks and their embeddings.
+
+        Returns a dict with the selected `chunks` (most relevant first),
+        `tokens_used`, `candidate_tokens` (all candidates joined),
+        `tokens_saved` and `duplicates_dropped`.
+        """
+        tokens = [self.count(c) for c in chunks]
+        result = {
+            "chunks": [],
+            "tokens_used": 0,
+            "candidate_tokens": sum(tokens),
+            "tokens_saved": sum(tokens),
+            "duplicates_dropped": 0,
+        }
+        if not chunks:
+            return result
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        relevance = vectors @ query
+        similarity = vectors @ vectors.T
+
+        # 1. MMR order, skipping near-duplicates of anything already kept
+        remaining = list(range(len(chunks)))
+        kept: List[int] = []
+        mmr_scores: Dict[int, float] = {}
+        while remaining:
+            if kept:
+                redundancy = similarity[np.ix_(remaining, kept)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1.0 - self.mmr_lambda) * redundancy
+            pick = int(np.argmax(scores))
+            idx = remaining.pop(pick)
+            if redundancy[pick] >= self.duplicate_threshold:
+                result["duplicates_dropped"] += 1
+                continue
+            kept.append(idx)
+            mmr_scores[idx] = float(scores[pick])
+
+        # 2. Greedy knapsack on value density; shift scores so all are positive
+        floor = min(mmr_scores.values())
+        density = {i: (mmr_scores[i] - floor + 1e-6) / max(tokens[i], 1) for i in kept}
+        packed: List[int] = []
+        used = 0
+        for i in sorted(kept, key=density.get, reverse=True):
+            if used + tokens[i] <= self.token_budget:
+                packed.append(i)
+                used += tokens[i]
+
+        # 3. Most relevant first in the prompt
+        packed.sort(key=lambda i: relevance[i], reverse=True)
+        result["chunks"] = [chunks[i] for i in packed]
+        result["tokens_used"] = used
+        result["tokens_saved"] = result["candidate_tokens"] - used
+        return result
@@ -0,0 +1,162 @@
+"""
+Embedding pipeline for RAG indexing.
+
+- EmbeddingCache: content-hash keyed vectors, persisted in a local SQLite file.
+- EmbeddingPipeline: cache lookup, size-bounded batching, and concurrent
+  dispatch of the remaining batches over a bounded thread pool.
+
+Only texts whose hash is not cached are sent to the provider, so re-indexing
+an unchanged (or slightly edited) document costs little or nothing.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+def content_key(text: str, model: str) -> str:
+    """Cache key: the model name is part of the hash so models never collide."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent key -> float32 vector cache backed by SQLite.
+
+    Pass `path=None` for a process-local in-memory cache.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or ":memory:"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def make_batches(
+    texts: Sequence[str],
+    max_batch_size: int,
+    max_batch_tokens: int,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> List[List[str]]:
+    """Split texts into batches bounded by item count and total tokens.
+
+    A single text larger than `max_batch_tokens` gets its own batch; the
+    provider decides whether it fits its per-input limit.
+    """
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and (len(current) >= max_batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingPipeline:
+    """Cached, batched, concurrent embedding of text chunks."""
+
+    def __init__(
+        self,
+        client,
+        model: str = "text-embedding-3-small",
+        cache: Optional[EmbeddingCache] = None,
+        max_batch_size: int = 512,
+        max_batch_tokens: int = 100_000,
+        max_workers: int = 4,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        self.client = client
+        self.model = model
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_workers = max_workers
+        self.count_tokens = count_tokens
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "api_calls": 0}
+
+    def _embed_batch(self, batch: List[str]) -> List[np.ndarray]:
+        response = self.client.embeddings.create(model=self.model, input=batch)
+        return [np.asarray(item.embedding, dtype=np.float32) for item in response.data]
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        """Embed texts, returning a (len(texts), dims) float32 matrix in input order."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [content_key(t, self.model) for t in texts]
+        vectors = self.cache.get_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        self.stats["cache_hits"] += len(texts) - sum(1 for k in keys if k in missing)
+        self.stats["cache_misses"] += len(missing)
+
+        if missing:
+            batches = make_batches(
+                list(missing.values()), self.max_batch_size, self.max_batch_tokens, self.count_tokens
+            )
+            self.stats["api_calls"] += len(batches)
+            if len(batches) == 1 or self.max_workers <= 1:
+                results = [self._embed_batch(b) for b in batches]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                    results = list(pool.map(self._embed_batch, batches))
+            fresh = dict(zip(missing.keys(), (v for batch in results for v in batch)))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+
+        return np.stack([vectors[k] for k in keys])
@@ -6,9 +6,16 @@ Demonstrates RAG: document indexing, vector search, context augmentation, answer
 """
 
 import os
-from typing import List, Dict
+from itertools import islice
+from typing import Iterable, List, Dict, Optional, Union
 from dotenv import load_dotenv
 
+from chunking import count_tokens, iter_chunks
+from context_builder import ContextBuilder
+from embedding_pipeline import EmbeddingCache, EmbeddingPipeline
+from sparse_index import BM25Index, reciprocal_rank_fusion
+from vector_store import ExactIndex, IVFIndex, QuantizedIndex
+
 try:
     import openai
     OPENAI_AVAILABLE = True
@@ -27,8 +34,43 @@ load_dotenv()
 class RAGSystem:
     """RAG-powered document Q&A system."""
     
-    def __init__(self):
-        """Initialize RAG system."""
+    RETRIEVAL_BACKENDS = ("chroma", "exact", "ivf")
+    INDEX_GROUP_SIZE = 1024  # chunks embedded and stored per step while streaming
+    HYBRID_DEPTH = 50  # candidates taken from each retriever before fusion
+
+    def __init__(
+        self,
+        retrieval_backend: Optional[str] = None,
+        n_lists: int = 256,
+        nprobe: int = 8,
+        embedding_cache_path: Optional[str] = None,
+        embedding_workers: int = 4,
+        chunk_tokens: int = 256,
+        chunk_overlap: int = 32,
+        hybrid: bool = True,
+        quantization: Optional[str] = None,
+        context_token_budget: int = 1500,
+        context_candidates: int = 10,
+    ):
+        """Initialize RAG system.
+
+        Args:
+            retrieval_backend: "chroma", "exact" or "ivf". Defaults to ChromaDB
+                when installed, otherwise the exact in-process index.
+            n_lists: Number of IVF posting lists (k-means centroids).
+            nprobe: Posting lists scanned per query by the IVF backend.
+            embedding_cache_path: SQLite file for the embedding cache
+                (default: $RAG_EMBEDDING_CACHE, else in-memory only).
+            embedding_workers: Concurrent embedding requests per indexing call.
+            chunk_tokens: Maximum tokens per chunk.
+            chunk_overlap: Tokens of trailing context repeated in the next chunk.
+            hybrid: Fuse BM25 keyword results with vector results (RRF).
+            quantization: Compress the "exact" backend's vectors with "int8"
+                (4x smaller) or "pq" (product quantization, one byte per 16
+                dims in memory, re-ranked against float32 copies on disk).
+            context_token_budget: Maximum context tokens sent with a question.
+            context_candidates: Chunks retrieved before dedup and packing.
+        """
         load_dotenv()
         
         api_key = os.getenv("OPENAI_API_KEY")
@@ -36,83 +78,153 @@ class RAGSystem:
             raise ValueError("OpenAI API key required")
         
         self.client = openai.OpenAI(api_key=api_key)
+        self.embedder = EmbeddingPipeline(
+            self.client,
+            model="text-embedding-3-small",
+            cache=EmbeddingCache(embedding_cache_path or os.getenv("RAG_EMBEDDING_CACHE")),
+            max_workers=embedding_workers,
+            count_tokens=count_tokens,
+        )
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        
+        if retrieval_backend is None:
+            retrieval_backend = "chroma" if CHROMADB_AVAILABLE else "exact"
+        if retrieval_backend not in self.RETRIEVAL_BACKENDS:
+            raise ValueError(f"Unknown retrieval backend: {retrieval_backend}")
+        if retrieval_backend == "chroma" and not CHROMADB_AVAILABLE:
+            raise ValueError("chromadb not installed; use retrieval_backend='exact' or 'ivf'")
+        if quantization and retrieval_backend != "exact":
+            raise ValueError("quantization is only supported with retrieval_backend='exact'")
+        self.retrieval_backend = retrieval_backend
+        self.hybrid = hybrid
+        self.context_builder = ContextBuilder(token_budget=context_token_budget)
+        self.context_candidates = context_candidates
+        self.last_context: Dict = {}
+        self.tokens_saved_total = 0
+        
+        # Chunk rows: documents[i] is row i of the in-process and keyword indexes
+        self.documents = []
+        self.sparse_index = BM25Index()
         
         # Initialize vector database
-        if CHROMADB_AVAILABLE:
+        if retrieval_backend == "chroma":
             self.chroma_client = chromadb.Client()
             self.collection = self.chroma_client.create_collection(name="documents")
         else:
             self.chroma_client = None
             self.collection = None
-            # Fallback: in-memory storage
-            self.documents = []
+            # Fallback: in-memory vector storage
+            if retrieval_backend == "ivf":
+                self.index = IVFIndex(n_lists=n_lists, nprobe=nprobe)
+            elif quantization:
+                self.index = QuantizedIndex(quantization)
+            else:
+                self.index = ExactIndex()
     
-    def index_document(self, text: str, doc_id: str = None):
-        """Index a document into vector database."""
-        # Chunk document (simple chunking)
-        chunk_size = 500
-        chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-        
-        # Generate embeddings
+    def index_document(self, text: Union[str, Iterable[str]], doc_id: str = None):
+        """Index a document into vector database.
+
+        `text` may be a string or a stream of text (e.g. an open file); chunks
+        are embedded and stored in groups, so the document is never held in
+        memory in full.
+        """
+        # Chunk on sentence/paragraph boundaries, sized by tokens
+        chunks = iter_chunks(text, max_tokens=self.chunk_tokens, overlap_tokens=self.chunk_overlap)
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=chunks
-            )
-            embeddings = [item.embedding for item in response.data]
-            
-            # Store in vector DB
-            if self.collection:
-                self.collection.add(
-                    embeddings=embeddings,
-                    documents=chunks,
-                    ids=[f"{doc_id}_{i}" for i in range(len(chunks))]
-                )
-            else:
-                # Fallback storage
-                for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-                    self.documents.append({
-                        "id": f"{doc_id}_{i}",
-                        "text": chunk,
-                        "embedding": emb
-                    })
+            start = 0
+            while True:
+                group = list(islice(chunks, self.INDEX_GROUP_SIZE))
+                if not group:
+                    break
+                self._store_chunks(group, doc_id, start)
+                start += len(group)
         except Exception as e:
             print(f"Error indexing document: {e}")
     
+    def index_file(self, path: str, doc_id: str = None):
+        """Stream a text file from disk into the index."""
+        with open(path, "r", encoding="utf-8") as f:
+            self.index_document(f, doc_id=doc_id or os.path.basename(path))
+    
+    def _store_chunks(self, chunks: List[str], doc_id: str, start: int):
+        """Embed one group of chunks and add it to the vector store."""
+        # Generate embeddings (cached, batched, concurrent)
+        embeddings = self.embedder.embed(chunks)
+        ids = [f"{doc_id}_{i}" for i in range(start, start + len(chunks))]
+        
+        # Store in vector DB
+        if self.collection:
+            self.collection.add(
+                embeddings=embeddings.tolist(),
+                documents=chunks,
+                ids=ids
+            )
+        else:
+            # Fallback storage
+            self.index.add(embeddings)
+        for chunk_id, chunk in zip(ids, chunks):
+            self.documents.append({
+                "id": chunk_id,
+                "text": chunk
+            })
+        self.sparse_index.add(chunks)
+    
     def retrieve_context(self, query: str, top_k: int = 3) -> List[str]:
-        """Retrieve relevant context for query."""
+        """Retrieve relevant context for query.
+
+        With `hybrid` enabled, vector and BM25 rankings are merged with
+        reciprocal-rank fusion so exact identifiers (error codes, part
+        numbers) are found even when embeddings miss them.
+        """
         try:
             # Embed query
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=[query]
-            )
-            query_embedding = response.data[0].embedding
+            query_embedding = self.embedder.embed([query])[0]
+            depth = max(top_k, self.HYBRID_DEPTH) if self.hybrid else top_k
             
             # Search vector DB
             if self.collection:
                 results = self.collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=top_k
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=depth
                 )
-                return results['documents'][0] if results['documents'] else []
+                dense = results['documents'][0] if results['documents'] else []
             else:
-                # Simple similarity search (fallback)
-                import numpy as np
-                similarities = []
-                for doc in self.documents:
-                    sim = np.dot(query_embedding, doc["embedding"])
-                    similarities.append((sim, doc["text"]))
-                similarities.sort(reverse=True)
-                return [text for _, text in similarities[:top_k]]
+                # In-process index (fallback)
+                hits = self.index.search(query_embedding, top_k=depth)
+                dense = [self.documents[row]["text"] for row, _ in hits]
+            
+            if not self.hybrid:
+                return dense[:top_k]
+            
+            # Keyword search, then fuse the two rankings
+            sparse = [self.documents[row]["text"] for row, _ in self.sparse_index.search(query, top_k=depth)]
+            return reciprocal_rank_fusion([dense, sparse])[:top_k]
         except Exception as e:
             print(f"Error retrieving context: {e}")
             return []
     
+    def build_context(self, query: str) -> Dict:
+        """Select context chunks for `query` within the token budget.
+
+        Returns the ContextBuilder result (chunks, tokens_used, tokens_saved,
+        ...), also kept as `last_context`. Chunk embeddings come from the
+        embedding cache, so this adds no embedding calls.
+        """
+        candidates = self.retrieve_context(query, top_k=self.context_candidates)
+        if not candidates:
+            built = self.context_builder.build([], [], [])
+        else:
+            query_embedding = self.embedder.embed([query])[0]
+            built = self.context_builder.build(query_embedding, candidates, self.embedder.embed(candidates))
+        self.last_context = built
+        self.tokens_saved_total += built["tokens_saved"]
+        return built
+    
     def answer_question(self, query: str) -> str:
         """Answer question using RAG."""
-        # Retrieve context
-        context_chunks = self.retrieve_context(query, top_k=3)
+        # Retrieve context, then dedupe and pack it into the token budget
+        context_chunks = self.build_context(query)["chunks"]
         context = "\n\n".join(context_chunks) if context_chunks else "No relevant context found."
         
         # Augment prompt with context
@@ -142,7 +254,12 @@ def main():
     print("Type 'quit' to exit\n")
     
     try:
-        rag = RAGSystem()
+        rag = RAGSystem(
+            embedding_cache_path=os.getenv(
+                "RAG_EMBEDDING_CACHE",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rag_embedding_cache.sqlite"),
+            )
+        )
     except Exception as e:
         print(f"Error: {e}")
         return
@@ -168,7 +285,9 @@ def main():
                 continue
             
             answer = rag.answer_question(query)
-            print(f"\nAnswer: {answer}\n")
+            print(f"\nAnswer: {answer}")
+            stats = rag.last_context
+            print(f"(context: {stats.get('tokens_used', 0)} tokens, {stats.get('tokens_saved', 0)} saved)\n")
             
         except KeyboardInterrupt:
             print("\n\nGoodbye!")
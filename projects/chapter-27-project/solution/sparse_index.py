@@ -0,0 +1,110 @@
+"""
+In-process BM25 keyword index and reciprocal-rank fusion.
+
+Embeddings are weak at exact identifiers ("E-4021", "LoRaWAN 1.0"); a sparse
+index catches them. Postings are compact `array.array` columns (row ids and
+term frequencies) per term, converted to NumPy once and cached until the term
+receives new postings, so scoring a query touches only the postings of its
+terms.
+"""
+
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Keeps identifiers such as "e-4021", "1.0" or "rs_485" as single tokens
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-._/][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers also emit their parts."""
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(p for p in re.split(r"[-._/]", token) if p)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over an append-only set of rows."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._rows: Dict[str, array] = {}
+        self._freqs: Dict[str, array] = {}
+        self._frozen: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._doc_lengths = array("I")
+        self._total_length = 0
+        self._lengths_np: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, texts: Sequence[str]) -> None:
+        """Append rows; row ids continue from the current length."""
+        for text in texts:
+            row = len(self._doc_lengths)
+            terms = tokenize(text)
+            for term, tf in Counter(terms).items():
+                if term not in self._rows:
+                    self._rows[term] = array("I")
+                    self._freqs[term] = array("H")
+                self._rows[term].append(row)
+                self._freqs[term].append(min(tf, 0xFFFF))
+                self._frozen.pop(term, None)
+            self._doc_lengths.append(len(terms))
+            self._total_length += len(terms)
+        self._lengths_np = None
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        if term not in self._frozen:
+            self._frozen[term] = (
+                np.frombuffer(self._rows[term].tobytes(), dtype=np.uint32),
+                np.frombuffer(self._freqs[term].tobytes(), dtype=np.uint16).astype(np.float32),
+            )
+        return self._frozen[term]
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Top `top_k` `(row, score)` pairs; rows sharing no term are never returned."""
+        n_docs = len(self)
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t in self._rows]
+        if not n_docs or not terms or top_k <= 0:
+            return []
+        if self._lengths_np is None:
+            self._lengths_np = np.frombuffer(self._doc_lengths.tobytes(), dtype=np.uint32).astype(np.float32)
+        avg_length = self._total_length / n_docs or 1.0
+
+        all_rows, all_scores = [], []
+        for term in terms:
+            rows, tf = self._postings(term)
+            df = len(rows)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self._lengths_np[rows] / avg_length)
+            all_rows.append(rows)
+            all_scores.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+
+        rows = np.concatenate(all_rows)
+        scores = np.concatenate(all_scores)
+        if len(terms) > 1:
+            rows, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=scores)
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> List[Hashable]:
+    """Fuse ranked lists: score(item) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
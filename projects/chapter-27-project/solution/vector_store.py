@@ -0,0 +1,472 @@
+"""
+In-process vector indexes for the RAG fallback path (no ChromaDB).
+
+- ExactIndex: brute-force inner product over one float32 matrix.
+- IVFIndex: inverted-file approximate search (k-means coarse quantizer,
+  per-list posting matrices, `nprobe` lists scanned per query).
+- QuantizedIndex: compressed flat index (8-bit scalar or product
+  quantization) scored with asymmetric distance computation, optionally
+  re-ranking a shortlist against exact vectors kept on disk.
+
+All return `(row, score)` pairs, where `row` is the insertion order of the
+vector, so callers can keep their own row -> document mapping.
+"""
+
+import tempfile
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class _GrowableMatrix:
+    """Row-appendable matrix; appends are batched and concatenated lazily."""
+
+    def __init__(self, dims: Optional[int] = None, dtype=np.float32):
+        self.dims = dims
+        self.dtype = dtype
+        self._array = None
+        self._pending: List[np.ndarray] = []
+        self._rows = 0
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def append(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows, dtype=self.dtype)
+        if rows.ndim == 1:
+            rows = rows[None, :]
+        if self.dims is None:
+            self.dims = rows.shape[1]
+        elif rows.shape[1] != self.dims:
+            raise ValueError(f"expected {self.dims}-dim vectors, got {rows.shape[1]}")
+        self._pending.append(rows)
+        self._rows += rows.shape[0]
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._pending:
+            parts = ([self._array] if self._array is not None else []) + self._pending
+            self._array = np.ascontiguousarray(np.concatenate(parts), dtype=self.dtype)
+            self._pending = []
+        if self._array is None:
+            return np.zeros((0, self.dims or 0), dtype=self.dtype)
+        return self._array
+
+
+class _DiskMatrix:
+    """Append-only float32 rows in a file, read back through a memory map so
+    only the rows asked for are paged in."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._file = open(path, "w+b") if path else tempfile.TemporaryFile()
+        self.dims: Optional[int] = None
+        self._rows = 0
+        self._map = None
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def append(self, rows: np.ndarray) -> None:
+        rows = np.ascontiguousarray(rows, dtype=np.float32)
+        if self.dims is None:
+            self.dims = rows.shape[1]
+        elif rows.shape[1] != self.dims:
+            raise ValueError(f"expected {self.dims}-dim vectors, got {rows.shape[1]}")
+        self._file.seek(0, 2)
+        self._file.write(rows.tobytes())
+        self._rows += rows.shape[0]
+        self._map = None
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        if self._map is None:
+            self._file.flush()
+            self._map = np.memmap(self._file, dtype=np.float32, mode="r", shape=(self._rows, self.dims))
+        return np.asarray(self._map[rows])
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the `top_k` largest scores, best first."""
+    k = min(top_k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[0])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+class ExactIndex:
+    """Exact inner-product search over all stored vectors."""
+
+    def __init__(self, dims: Optional[int] = None):
+        self._matrix = _GrowableMatrix(dims)
+
+    def __len__(self) -> int:
+        return len(self._matrix)
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> None:
+        self._matrix.append(embeddings)
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> List[Tuple[int, float]]:
+        if not len(self):
+            return []
+        scores = self._matrix.array @ np.asarray(query, dtype=np.float32)
+        return [(int(i), float(scores[i])) for i in _top_k(scores, top_k)]
+
+
+def _nearest_l2(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid (Euclidean) for each row."""
+    return np.argmax(data @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+
+
+def kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0, spherical: bool = True
+) -> np.ndarray:
+    """k-means; spherical (cosine assignment, unit-norm centroids) by default."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(vectors, dtype=np.float32)
+    if spherical:
+        data = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+    centroids = data[rng.choice(len(data), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        if spherical:
+            assign = np.argmax(data @ centroids.T, axis=1)
+        else:
+            assign = _nearest_l2(data, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        # Per-cluster sums via sort + reduceat (much faster than np.add.at)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        sums[counts > 0] = np.add.reduceat(data[order], starts[counts > 0], axis=0)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points so every list stays useful
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        if spherical:
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        else:
+            centroids = sums / counts[:, None]
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file index: approximate inner-product search.
+
+    Vectors are bucketed by their nearest k-means centroid. A query scores the
+    centroids, then scans only the `nprobe` closest posting lists. Until the
+    index holds enough vectors to train (`n_lists * min_points_per_list`) it
+    behaves like an exact scan over the buffered vectors; training happens
+    automatically on the first search after that threshold, or explicitly via
+    `train()`. Centroids fitted on the first vectors drift from the data as
+    the index grows, so a search also retrains once the index has grown by
+    `retrain_growth` times since the last training (doubling keeps the total
+    training cost linear in the index size); `retrain_growth=None` turns this
+    off.
+    """
+
+    def __init__(
+        self,
+        n_lists: int = 256,
+        nprobe: int = 8,
+        min_points_per_list: int = 4,
+        max_train_points: int = 100_000,
+        seed: int = 0,
+        retrain_growth: Optional[float] = 2.0,
+    ):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_points_per_list = min_points_per_list
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.retrain_growth = retrain_growth
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._buffer = _GrowableMatrix()
+        self._lists: List[_GrowableMatrix] = []
+        self._list_rows: List[List[int]] = []
+        self._list_row_arrays: List[Optional[np.ndarray]] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        rows = np.arange(self._size, self._size + len(vectors))
+        self._size += len(vectors)
+        if self.is_trained:
+            self._assign(vectors, rows)
+        else:
+            self._buffer.append(vectors)
+
+    def train(self) -> None:
+        """(Re)build the coarse quantizer from all vectors added so far."""
+        vectors = self._all_vectors()
+        if len(vectors) == 0:
+            return
+        n_lists = max(1, min(self.n_lists, len(vectors)))
+        sample = vectors
+        if len(vectors) > self.max_train_points:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), size=self.max_train_points, replace=False)]
+        self.centroids = kmeans(sample, n_lists, seed=self.seed)
+        self.trained_size = len(vectors)
+        self._lists = [_GrowableMatrix(vectors.shape[1]) for _ in range(n_lists)]
+        self._list_rows = [[] for _ in range(n_lists)]
+        self._list_row_arrays = [None] * n_lists
+        self._buffer = _GrowableMatrix()
+        self._assign(vectors, np.arange(len(vectors)))
+
+    def _needs_training(self) -> bool:
+        if not self.is_trained:
+            return self._size >= self.n_lists * self.min_points_per_list
+        return bool(self.retrain_growth) and self._size >= self.retrain_growth * self.trained_size
+
+    def _all_vectors(self) -> np.ndarray:
+        if not self.is_trained:
+            return self._buffer.array
+        order = np.concatenate([np.asarray(r, dtype=np.int64) for r in self._list_rows])
+        vectors = np.concatenate([lst.array for lst in self._lists])
+        out = np.empty_like(vectors)
+        out[order] = vectors
+        return out
+
+    def _assign(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for list_id in np.unique(assign):
+            mask = assign == list_id
+            self._lists[list_id].append(vectors[mask])
+            self._list_rows[list_id].extend(rows[mask].tolist())
+            self._list_row_arrays[list_id] = None
+
+    def _rows_of(self, list_id: int) -> np.ndarray:
+        if self._list_row_arrays[list_id] is None:
+            self._list_row_arrays[list_id] = np.asarray(self._list_rows[list_id], dtype=np.int64)
+        return self._list_row_arrays[list_id]
+
+    def search(
+        self, query: Sequence[float], top_k: int = 3, nprobe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        if not self._size:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        if self._needs_training():
+            self.train()
+        if not self.is_trained:
+            scores = self._buffer.array @ q
+            return [(int(i), float(scores[i])) for i in _top_k(scores, top_k)]
+
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = _top_k(self.centroids @ q, nprobe)
+        scores = np.concatenate([self._lists[i].array @ q for i in probe])
+        rows = np.concatenate([self._rows_of(i) for i in probe])
+        return [(int(rows[i]), float(scores[i])) for i in _top_k(scores, top_k)]
+
+
+class ScalarQuantizer:
+    """8-bit per-dimension scalar quantization (4x smaller than float32).
+
+    x ~= low + scale * code, so q . x ~= q . low + (q * scale) . code: the
+    query stays float32 and only the stored side is quantized.
+    """
+
+    def fit(self, vectors: np.ndarray) -> None:
+        self.low = vectors.min(axis=0).astype(np.float32)
+        high = vectors.max(axis=0).astype(np.float32)
+        self.scale = np.maximum(high - self.low, 1e-12) / 255.0
+
+    def bytes_per_vector(self, dims: int) -> int:
+        return dims
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Decoding the block to float32 first lets the product run through BLAS
+        return codes.astype(np.float32) @ (query * self.scale) + float(query @ self.low)
+
+
+def default_subvectors(dims: int) -> int:
+    """About one sub-vector per 16 dims (96 bytes for 1536-dim embeddings)."""
+    m = max(1, dims // 16)
+    while dims % m:
+        m -= 1
+    return m
+
+
+class ProductQuantizer:
+    """Product quantization: `n_subvectors` bytes per vector.
+
+    Each vector is split into sub-vectors, each replaced by the id of its
+    nearest of 256 sub-centroids. Scoring builds a per-query lookup table of
+    sub-centroid inner products and sums table entries (ADC). Without
+    `n_subvectors`, `default_subvectors(dims)` is used.
+    """
+
+    def __init__(self, n_subvectors: Optional[int] = None, n_centroids: int = 256, seed: int = 0):
+        if n_centroids > 256:
+            raise ValueError("codes are stored as uint8; n_centroids must be <= 256")
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.seed = seed
+
+    def fit(self, vectors: np.ndarray) -> None:
+        dims = vectors.shape[1]
+        if self.n_subvectors is None:
+            self.n_subvectors = default_subvectors(dims)
+        if dims % self.n_subvectors:
+            raise ValueError(f"{dims} dims is not divisible by {self.n_subvectors} sub-vectors")
+        self.sub_dims = dims // self.n_subvectors
+        self.codebooks = np.stack([
+            kmeans(self._sub(vectors, j), min(self.n_centroids, len(vectors)),
+                   seed=self.seed + j, spherical=False)
+            for j in range(self.n_subvectors)
+        ])
+
+    def _sub(self, vectors: np.ndarray, j: int) -> np.ndarray:
+        return vectors[:, j * self.sub_dims:(j + 1) * self.sub_dims]
+
+    def bytes_per_vector(self, dims: int) -> int:
+        return self.n_subvectors
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [_nearest_l2(self._sub(vectors, j), self.codebooks[j]) for j in range(self.n_subvectors)],
+            axis=1,
+        ).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        sub_queries = query.reshape(self.n_subvectors, self.sub_dims)
+        table = np.einsum("jkd,jd->jk", self.codebooks, sub_queries)  # (m, k)
+        # One contiguous gather per sub-vector is faster than a 2-D fancy index
+        columns = np.ascontiguousarray(codes.T)
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.n_subvectors):
+            scores += table[j][columns[j]]
+        return scores
+
+
+class QuantizedIndex:
+    """Flat index over compressed codes, scored with asymmetric distances.
+
+    `quantization` is "int8" (ScalarQuantizer) or "pq" (ProductQuantizer).
+    Vectors are kept as float32 until `min_train_points` have been added;
+    the quantizer is then trained (on at most `max_train_points` vectors) and
+    the float32 copies are dropped from memory.
+
+    With `rerank`, exact float32 copies are also written to a file
+    (`rerank_path`, or an anonymous temporary file) and the best
+    `rerank * top_k` code matches, at most `max_rerank` (but never fewer than
+    `top_k`), are re-scored against them, so memory holds only the codes but
+    the final ranking is exact. PQ alone loses too much recall to rank on
+    its own, so it re-ranks by default (`rerank=200`); int8 does not.
+
+    Each search reads up to `max_rerank * 4 * dims` bytes of the file (about
+    6 MB at the default 1000 rows and 1536 dims), cheap once the file is in
+    the page cache but a random read per row when it is not. Lower
+    `max_rerank` for deep searches (e.g. hybrid retrieval's 50 candidates)
+    on a cold disk.
+    """
+
+    SCORE_BLOCK = 4096  # rows decoded per step; bounds temporary memory
+
+    def __init__(
+        self,
+        quantization: str = "int8",
+        pq_subvectors: Optional[int] = None,
+        min_train_points: int = 1024,
+        max_train_points: int = 50_000,
+        seed: int = 0,
+        rerank: Optional[int] = None,
+        rerank_path: Optional[str] = None,
+        max_rerank: int = 1000,
+    ):
+        if quantization == "int8":
+            self.quantizer = ScalarQuantizer()
+        elif quantization == "pq":
+            self.quantizer = ProductQuantizer(n_subvectors=pq_subvectors, seed=seed)
+        else:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.rerank = (200 if quantization == "pq" else 0) if rerank is None else rerank
+        self.max_rerank = max_rerank
+        self._exact = _DiskMatrix(rerank_path) if self.rerank else None
+        self.min_train_points = min_train_points
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.is_trained = False
+        self._buffer = _GrowableMatrix()
+        self._codes = _GrowableMatrix(dtype=np.uint8)
+        self.dims: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._codes) if self.is_trained else len(self._buffer)
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """Bytes per vector held in memory (float32 until the quantizer is
+        trained); re-rank copies on disk are not counted."""
+        if self.dims is None:
+            return 0
+        if not self.is_trained:
+            return 4 * self.dims
+        return self.quantizer.bytes_per_vector(self.dims)
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        self.dims = vectors.shape[1]
+        if self._exact is not None:
+            self._exact.append(vectors)
+        if self.is_trained:
+            self._codes.append(self.quantizer.encode(vectors))
+            return
+        self._buffer.append(vectors)
+        if len(self._buffer) >= self.min_train_points:
+            self.train()
+
+    def train(self) -> None:
+        """Fit the quantizer and encode (then drop) the buffered float32 vectors."""
+        vectors = self._buffer.array
+        if len(vectors) == 0:
+            return
+        sample = vectors
+        if len(vectors) > self.max_train_points:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), size=self.max_train_points, replace=False)]
+        self.quantizer.fit(sample)
+        for start in range(0, len(vectors), self.SCORE_BLOCK):
+            self._codes.append(self.quantizer.encode(vectors[start:start + self.SCORE_BLOCK]))
+        self._buffer = _GrowableMatrix()
+        self.is_trained = True
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> List[Tuple[int, float]]:
+        if not len(self):
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        if not self.is_trained:
+            scores = self._buffer.array @ q
+        else:
+            codes = self._codes.array
+            scores = np.concatenate([
+                self.quantizer.scores(q, codes[start:start + self.SCORE_BLOCK])
+                for start in range(0, len(codes), self.SCORE_BLOCK)
+            ])
+            if self._exact is not None:
+                # Sorted rows read the file front to back
+                depth = min(self.rerank * top_k, max(self.max_rerank, top_k))
+                shortlist = np.sort(_top_k(scores, depth))
+                exact = self._exact.take(shortlist) @ q
+                return [(int(shortlist[i]), float(exact[i])) for i in _top_k(exact, top_k)]
+        return [(int(i), float(scores[i])) for i in _top_k(scores, top_k)]
@@ -0,0 +1,435 @@
+"""
+Coordinator/worker mode for the workflow engine.
+
+The coordinator (`DistributedOrchestrator`) schedules the DAG exactly like
+`WorkflowOrchestrator`, but a task registered by reference ("module:function")
+is sent as a job over a transport instead of being run locally. Workers pull
+jobs, run them and post the results back.
+
+Jobs are leased, not handed over: a worker owns a job only while it keeps
+heartbeating. If a worker dies, its lease expires and the next `lease` call
+hands the job to another worker (up to `max_attempts` leases per job).
+
+Built-in transports:
+- InProcessTransport: thread-safe queue, for worker threads in this process.
+- SQLiteTransport: a WAL-mode SQLite file, shared by worker processes on the
+  same host (`python workflow_distributed.py worker <db>`).
+Other transports (e.g. a network queue for several hosts) implement the
+abstract `Transport` methods. Jobs carry the id of the coordinator that
+submitted them, and a coordinator only collects its own results, so several
+coordinators can share one transport.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from workflow_system import TaskStatus, WorkflowOrchestrator
+
+
+class Transport(ABC):
+    """Job queue between the coordinator and workers.
+
+    A job is a dict with `id`, `owner` (the submitting coordinator), `task`
+    (task id), `fn` ("module:function"), `args` and `kwargs`. Finished jobs
+    come back from `collect` as dicts with `id`, `result` and `error` (None
+    on success).
+    """
+
+    @abstractmethod
+    def submit(self, job: Dict) -> None:
+        """Queue a job."""
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        """Claim the next pending (or expired) job, or None if there is none."""
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, job_id: str, lease_seconds: float) -> bool:
+        """Extend a lease; False if the worker no longer holds it."""
+
+    @abstractmethod
+    def complete(self, worker_id: str, job_id: str, result: Any = None, error: Optional[str] = None) -> bool:
+        """Post a job's outcome; ignored (False) if the lease was lost."""
+
+    @abstractmethod
+    def collect(self, owner: Optional[str] = None) -> List[Dict]:
+        """Remove and return finished jobs submitted by `owner` (every
+        finished job when None)."""
+
+
+class InProcessTransport(Transport):
+    """Transport for worker threads inside the coordinator's process."""
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = {}  # insertion order = FIFO
+        self._done: List[Dict] = []
+
+    def submit(self, job: Dict) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = {"job": job, "worker": None, "lease_until": 0.0, "attempts": 0}
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            for job_id, entry in list(self._jobs.items()):
+                if entry["worker"] is not None and entry["lease_until"] > now:
+                    continue
+                if entry["attempts"] >= self.max_attempts:
+                    del self._jobs[job_id]
+                    self._done.append({"id": job_id, "owner": entry["job"].get("owner"), "result": None,
+                                       "error": f"lease lost {entry['attempts']} times"})
+                    continue
+                entry.update(worker=worker_id, lease_until=now + lease_seconds,
+                             attempts=entry["attempts"] + 1)
+                return entry["job"]
+        return None
+
+    def heartbeat(self, worker_id: str, job_id: str, lease_seconds: float) -> bool:
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None or entry["worker"] != worker_id:
+                return False
+            entry["lease_until"] = time.time() + lease_seconds
+            return True
+
+    def complete(self, worker_id: str, job_id: str, result: Any = None, error: Optional[str] = None) -> bool:
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None or entry["worker"] != worker_id:
+                return False
+            del self._jobs[job_id]
+            self._done.append({"id": job_id, "owner": entry["job"].get("owner"), "result": result, "error": error})
+            return True
+
+    def collect(self, owner: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            if owner is None:
+                done, self._done = self._done, []
+            else:
+                done = [d for d in self._done if d["owner"] == owner]
+                self._done = [d for d in self._done if d["owner"] != owner]
+        return [{"id": d["id"], "result": d["result"], "error": d["error"]} for d in done]
+
+
+class SQLiteTransport(Transport):
+    """Transport backed by a SQLite file; safe across processes on one host.
+
+    Leasing runs in a `BEGIN IMMEDIATE` transaction, so two workers never
+    claim the same job. Results must be JSON-serializable.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, timeout: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, payload TEXT NOT NULL,"
+                " state TEXT NOT NULL DEFAULT 'pending',"  # pending | leased | done
+                " worker TEXT, lease_until REAL NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT,"
+                " seq INTEGER, owner TEXT)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:  # queue file from before jobs had owners
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, state)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit mode, transactions are explicit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, job: Dict) -> None:
+        self._connect().execute(
+            "INSERT INTO jobs (id, payload, owner, seq)"
+            " VALUES (?, ?, ?, (SELECT IFNULL(MAX(seq), 0) + 1 FROM jobs))",
+            (job["id"], json.dumps(job), job.get("owner")),
+        )
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker stopped heartbeating too often are given up on
+            conn.execute(
+                "UPDATE jobs SET state = 'done', error = 'lease lost ' || attempts || ' times'"
+                " WHERE state = 'leased' AND lease_until <= ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, payload FROM jobs"
+                " WHERE state = 'pending' OR (state = 'leased' AND lease_until <= ?)"
+                " ORDER BY seq LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?,"
+                    " attempts = attempts + 1 WHERE id = ?",
+                    (worker_id, now + lease_seconds, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return json.loads(row[1]) if row else None
+
+    def heartbeat(self, worker_id: str, job_id: str, lease_seconds: float) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, worker_id: str, job_id: str, result: Any = None, error: Optional[str] = None) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET state = 'done', result = ?, error = ?"
+            " WHERE id = ? AND worker = ? AND state = 'leased'",
+            (json.dumps(result, default=str), error, job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def collect(self, owner: Optional[str] = None) -> List[Dict]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if owner is None:
+                rows = conn.execute("SELECT id, result, error FROM jobs WHERE state = 'done'").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, result, error FROM jobs WHERE owner = ? AND state = 'done'", (owner,)
+                ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(r[0],) for r in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [
+            {"id": job_id, "result": json.loads(result) if result is not None else None, "error": error}
+            for job_id, result, error in rows
+        ]
+
+
+_FUNCTIONS: Dict[str, Callable] = {}
+
+
+def parse_ref(ref: str):
+    """Split "module:function" into its parts; ValueError if malformed."""
+    module_name, sep, attr = ref.partition(":")
+    if not sep or not module_name or not attr:
+        raise ValueError(f"Task reference must look like 'module:function', not {ref!r}")
+    return module_name, attr
+
+
+def resolve(ref: str) -> Callable:
+    """Import "module:function" (dotted attributes allowed), cached per process."""
+    if ref not in _FUNCTIONS:
+        module_name, attr = parse_ref(ref)
+        target = importlib.import_module(module_name)
+        for part in attr.split("."):
+            target = getattr(target, part)
+        _FUNCTIONS[ref] = target
+    return _FUNCTIONS[ref]
+
+
+class Worker:
+    """Pulls jobs from a transport, runs them and reports results.
+
+    While a job runs, a background thread renews its lease every
+    `heartbeat_interval` seconds (default: a third of `lease_seconds`).
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 10.0,
+        heartbeat_interval: Optional[float] = None,
+        poll_interval: float = 0.05,
+    ):
+        self.transport = transport
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+        self.poll_interval = poll_interval
+        self.jobs_done = 0
+
+    def _heartbeat(self, job_id: str, finished: threading.Event):
+        while not finished.wait(self.heartbeat_interval):
+            if not self.transport.heartbeat(self.worker_id, job_id, self.lease_seconds):
+                return  # lease lost; our result will be discarded
+
+    def run_job(self, job: Dict) -> bool:
+        finished = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job["id"], finished), daemon=True)
+        beat.start()
+        result, error = None, None
+        try:
+            outcome = resolve(job["fn"])(*job.get("args", []), **job.get("kwargs", {}))
+            if asyncio.iscoroutine(outcome):
+                outcome = asyncio.run(outcome)
+            result = outcome
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            finished.set()
+            beat.join()
+        self.jobs_done += 1
+        return self.transport.complete(self.worker_id, job["id"], result, error)
+
+    def run(self, stop: Optional[threading.Event] = None, max_jobs: Optional[int] = None,
+            idle_timeout: Optional[float] = None):
+        """Process jobs until `stop` is set, `max_jobs` ran, or nothing arrived
+        for `idle_timeout` seconds."""
+        stop = stop or threading.Event()
+        idle_since = time.monotonic()
+        while not stop.is_set() and (max_jobs is None or self.jobs_done < max_jobs):
+            job = self.transport.lease(self.worker_id, self.lease_seconds)
+            if job is None:
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    break
+                stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+            idle_since = time.monotonic()
+
+
+def run_sqlite_worker(path: str, lease_seconds: float = 10.0, idle_timeout: Optional[float] = None):
+    """Entry point for a worker process."""
+    Worker(SQLiteTransport(path), lease_seconds=lease_seconds).run(idle_timeout=idle_timeout)
+
+
+def spawn_workers(path: str, n: int, **kwargs) -> List[multiprocessing.Process]:
+    """Start `n` SQLite worker processes (daemonic; they stop with the parent)."""
+    processes = []
+    for _ in range(n):
+        process = multiprocessing.Process(target=run_sqlite_worker, args=(path,), kwargs=kwargs, daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+class DistributedOrchestrator(WorkflowOrchestrator):
+    """Coordinator: schedules the DAG and ships referenced tasks to workers.
+
+    Tasks added with a "module:function" string run on workers; callables
+    still run locally, so a DAG can mix both. If collecting results fails
+    (e.g. "database is locked"), the poller retries with exponential backoff
+    up to `max_poll_delay`; after `max_collect_failures` failures in a row it
+    fails every task still waiting, rather than leaving them hanging.
+    """
+
+    def __init__(self, transport: Transport, poll_interval: float = 0.02,
+                 max_poll_delay: float = 2.0, max_collect_failures: int = 8, **kwargs):
+        super().__init__(**kwargs)
+        self.transport = transport
+        self.poll_interval = poll_interval
+        self.max_poll_delay = max_poll_delay
+        self.max_collect_failures = max_collect_failures
+        self.coordinator_id = uuid.uuid4().hex
+        self.remote_args: Dict[str, Dict] = {}
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    def add_task(self, task_id: str, task_func, depends_on: List[str] = None,
+                 args: Optional[List] = None, kwargs: Optional[Dict] = None, **options):
+        """Add a task; `task_func` may be a "module:function" reference, called
+        on a worker with `args`/`kwargs` (which must survive the transport)."""
+        if isinstance(task_func, str):
+            parse_ref(task_func)
+            self.remote_args[task_id] = {"args": list(args or []), "kwargs": dict(kwargs or {})}
+        else:
+            self.remote_args.pop(task_id, None)
+        super().add_task(task_id, task_func, depends_on, **options)
+
+    async def execute_task(self, task_id: str) -> Any:
+        if task_id not in self.remote_args:
+            return await super().execute_task(task_id)
+
+        self._set_status(task_id, TaskStatus.RUNNING)
+        job = {"id": uuid.uuid4().hex, "owner": self.coordinator_id, "task": task_id,
+               "fn": self.tasks[task_id], **self.remote_args[task_id]}
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[job["id"]] = future
+        await asyncio.to_thread(self.transport.submit, job)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_results())
+        try:
+            outcome = await future
+        except Exception as e:
+            self._set_status(task_id, TaskStatus.FAILED, {"error": f"collecting the result failed: {e}"})
+            raise
+
+        if outcome["error"] is not None:
+            self._set_status(task_id, TaskStatus.FAILED, {"error": outcome["error"]})
+            raise RuntimeError(outcome["error"])
+        self._set_status(task_id, TaskStatus.SUCCESS, outcome["result"])
+        return outcome["result"]
+
+    async def _poll_results(self):
+        failures = 0
+        while self._waiting:
+            try:
+                finished = await asyncio.to_thread(self.transport.collect, self.coordinator_id)
+            except Exception as e:
+                failures += 1
+                if failures >= self.max_collect_failures:
+                    print(f"Collecting results failed {failures} times, giving up: {e}")
+                    waiting, self._waiting = self._waiting, {}
+                    for future in waiting.values():
+                        if not future.done():
+                            future.set_exception(e)
+                    return
+                delay = min(self.max_poll_delay, self.poll_interval * 2 ** failures)
+                print(f"Collecting results failed ({e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            for outcome in finished:
+                future = self._waiting.pop(outcome["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(outcome)
+            if self._waiting:
+                await asyncio.sleep(self.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workflow worker")
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="run a worker against a SQLite job queue")
+    worker.add_argument("db", help="path to the shared SQLite queue file")
+    worker.add_argument("--processes", type=int, default=1)
+    worker.add_argument("--lease-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_sqlite_worker(args.db, lease_seconds=args.lease_seconds)
+        return
+    for process in spawn_workers(args.db, args.processes, lease_seconds=args.lease_seconds):
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
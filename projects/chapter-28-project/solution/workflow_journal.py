@@ -0,0 +1,131 @@
+"""
+Append-only checkpoint journal for workflow runs.
+
+Each run has one JSONL file (`<run_id>.jsonl`): a header line with the start
+tasks, then one compact line per task transition (`{"t": task, "s": status,
+"r": result}`). Records are buffered in memory and written in batches by a
+background flusher, off the event loop, so journaling never sits on a task's
+critical path. A crash loses at most the last unflushed batch; those tasks
+simply run again on resume.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+
+class CheckpointJournal:
+    """Batched JSONL journal of task transitions, one file per run."""
+
+    def __init__(self, directory: str, flush_interval: float = 0.05, max_batch: int = 512):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        os.makedirs(directory, exist_ok=True)
+        self._buffers: Dict[str, List[Dict]] = {}
+        self._pending = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def path(self, run_id: str) -> str:
+        return os.path.join(self.directory, f"{run_id}.jsonl")
+
+    def exists(self, run_id: str) -> bool:
+        return os.path.exists(self.path(run_id))
+
+    def _append(self, run_id: str, record: Dict) -> None:
+        # Serialization happens in the writer, not on the caller's path
+        self._buffers.setdefault(run_id, []).append(record)
+        self._pending += 1
+        if self._wakeup is not None and self._pending >= self.max_batch:
+            self._wakeup.set()
+
+    def start_run(self, run_id: str, start_tasks: List[str]) -> None:
+        self._append(run_id, {"run": run_id, "start": list(start_tasks)})
+
+    def record(self, run_id: str, task_id: str, status: str, result: Any = None) -> None:
+        """Buffer a transition; written by the next flush."""
+        record = {"t": task_id, "s": status}
+        if result is not None:
+            record["r"] = result
+        self._append(run_id, record)
+
+    # --- Writing ---------------------------------------------------------------
+
+    def _write(self, buffers: Dict[str, List[Dict]]) -> None:
+        for run_id, records in buffers.items():
+            lines = [json.dumps(r, separators=(",", ":"), default=str) for r in records]
+            with open(self.path(run_id), "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def flush_sync(self) -> None:
+        buffers, self._buffers, self._pending = self._buffers, {}, 0
+        if buffers:
+            self._write(buffers)
+
+    async def flush(self) -> None:
+        """Write buffered records in a worker thread (batches stay in order)."""
+        async with self._lock:
+            buffers, self._buffers, self._pending = self._buffers, {}, 0
+            if buffers:
+                await asyncio.to_thread(self._write, buffers)
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop."""
+        if self._flusher is None:
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._stopping = False
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write everything still buffered."""
+        if self._flusher is not None:
+            # Let the flusher finish its in-flight batch rather than cancelling
+            # it mid-write: the final flush must land after it, not race it.
+            self._stopping = True
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+            await self.flush()
+            self._wakeup = self._lock = None
+        else:
+            self.flush_sync()
+
+    # --- Reading ---------------------------------------------------------------
+
+    def load(self, run_id: str) -> Dict:
+        """Replay a run's journal.
+
+        Returns `{"start_tasks": [...], "status": {task: status},
+        "results": {task: result}}` with the last transition per task. A
+        truncated final line (crash mid-write) is ignored.
+        """
+        state = {"start_tasks": [], "status": {}, "results": {}}
+        with open(self.path(run_id), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if "run" in record:
+                    state["start_tasks"] = record["start"]
+                    continue
+                state["status"][record["t"]] = record["s"]
+                if "r" in record:
+                    state["results"][record["t"]] = record["r"]
+        return state
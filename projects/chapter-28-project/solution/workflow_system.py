@@ -3,15 +3,23 @@ Automated IoT Incident Response Workflow - Complete Solution
 Chapter 28 Project
 
 Demonstrates workflow orchestration: DAGs, error recovery, human-in-the-loop.
+Requires Python 3.11+ (asyncio.TaskGroup).
 """
 
 import asyncio
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Dict, List, Callable, Optional
 from enum import Enum
 from datetime import datetime
 import os
+import uuid
 from dotenv import load_dotenv
 
+from workflow_journal import CheckpointJournal
+
 try:
     import openai
     OPENAI_AVAILABLE = True
@@ -31,21 +39,128 @@ class TaskStatus(Enum):
 
 
 class WorkflowOrchestrator:
-    """Workflow orchestrator with DAG support."""
+    """Workflow orchestrator with DAG support.
+    
+    Every task whose dependencies are met runs concurrently, up to
+    `max_concurrency` at a time (None = unlimited). Dependents are indexed
+    by a reverse adjacency map, so scheduling costs O(V + E) and cycles are
+    rejected when a task is added. With a `journal`, every transition is
+    checkpointed and an interrupted run can be continued with `resume`.
+    
+    Synchronous tasks run on an executor chosen at `add_task` time:
+    "inline" (on the event loop), "thread" (thread pool, for blocking I/O)
+    or "process" (process pool, for CPU-bound work).
+    
+    Tasks added with `requires_approval=True` are parked on a future until
+    `approve`/`reject` is called (from any thread). A parked task holds no
+    concurrency slot, so the rest of the DAG keeps running meanwhile.
+    """
     
-    def __init__(self):
-        """Initialize orchestrator."""
+    EXECUTORS = ("inline", "thread", "process")
+    
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        journal: Optional[CheckpointJournal] = None,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        on_escalate: Optional[Callable[[str, int], None]] = None,
+    ):
+        """Initialize orchestrator.
+        
+        `on_escalate(task_id, level)` is called (or awaited) each time an
+        approval times out and is escalated; it defaults to printing.
+        """
+        self.max_concurrency = max_concurrency
+        self.journal = journal
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._executors: Dict[str, Executor] = {}
+        self.task_executors: Dict[str, str] = {}
+        self.run_id: Optional[str] = None
         self.tasks: Dict[str, Callable] = {}
         self.dependencies: Dict[str, List[str]] = {}
+        self.dependents: Dict[str, List[str]] = {}  # reverse adjacency
         self.task_status: Dict[str, TaskStatus] = {}
         self.task_results: Dict[str, any] = {}
         self.human_approvals: Dict[str, bool] = {}
+        self.approval_gates: Dict[str, Dict] = {}
+        self.on_escalate = on_escalate
+        self._approval_futures: Dict[str, asyncio.Future] = {}
+        self._early_approvals: Dict[str, bool] = {}  # decided before the gate was reached
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
     
-    def add_task(self, task_id: str, task_func: Callable, depends_on: List[str] = None):
-        """Add task to workflow."""
+    def add_task(
+        self,
+        task_id: str,
+        task_func: Callable,
+        depends_on: List[str] = None,
+        executor: str = "inline",
+        requires_approval: bool = False,
+        approval_timeout: Optional[float] = None,
+        escalations: int = 0,
+        on_timeout: str = "reject",
+    ):
+        """Add task to workflow.
+        
+        Dependencies may name tasks that are added later. Raises ValueError if
+        the new edges would close a cycle, or if `executor` doesn't suit the
+        task (coroutines always run inline; "process" tasks must be
+        picklable, e.g. module-level functions or functools.partial).
+        
+        With `requires_approval`, the task waits for a human decision once its
+        dependencies succeed. Each `approval_timeout` seconds without one
+        escalates (up to `escalations` times); after that the task is
+        resolved by `on_timeout` ("reject" or "approve").
+        """
+        if executor not in self.EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+        if on_timeout not in ("reject", "approve"):
+            raise ValueError(f"on_timeout must be 'reject' or 'approve', not {on_timeout!r}")
+        if executor != "inline" and asyncio.iscoroutinefunction(task_func):
+            raise ValueError(f"Task {task_id} is a coroutine; it must use the inline executor")
+        if executor == "process":
+            try:
+                pickle.dumps(task_func)
+            except Exception as e:
+                raise ValueError(f"Task {task_id} cannot be sent to a process: {e}") from e
+        
+        deps = list(dict.fromkeys(depends_on or []))
+        if task_id in deps or self._reaches(task_id, set(deps)):
+            raise ValueError(f"Adding task {task_id} would create a dependency cycle")
+        
+        # Re-adding a task replaces its old edges
+        for dep in self.dependencies.get(task_id, []):
+            self.dependents[dep].remove(task_id)
+        
         self.tasks[task_id] = task_func
-        self.dependencies[task_id] = depends_on or []
+        self.task_executors[task_id] = executor
+        self.dependencies[task_id] = deps
         self.task_status[task_id] = TaskStatus.PENDING
+        self.approval_gates.pop(task_id, None)
+        if requires_approval:
+            self.approval_gates[task_id] = {
+                "timeout": approval_timeout,
+                "escalations": escalations,
+                "on_timeout": on_timeout,
+            }
+        for dep in deps:
+            self.dependents.setdefault(dep, []).append(task_id)
+    
+    def _reaches(self, start: str, targets: set) -> bool:
+        """True if any of `targets` depends (transitively) on `start`."""
+        if not targets:
+            return False
+        stack = [start]
+        seen = {start}
+        while stack:
+            for next_task in self.dependents.get(stack.pop(), []):
+                if next_task in targets:
+                    return True
+                if next_task not in seen:
+                    seen.add(next_task)
+                    stack.append(next_task)
+        return False
     
     def can_execute(self, task_id: str) -> bool:
         """Check if task can be executed (dependencies met)."""
@@ -55,80 +170,265 @@ class WorkflowOrchestrator:
             for dep in deps
         )
     
+    def _set_status(self, task_id: str, status: TaskStatus, result: any = None):
+        """Update a task's status (and result), checkpointing the transition."""
+        self.task_status[task_id] = status
+        if result is not None:
+            self.task_results[task_id] = result
+        if self.journal and self.run_id:
+            self.journal.record(self.run_id, task_id, status.value, result)
+    
     async def execute_task(self, task_id: str) -> any:
         """Execute a single task."""
         if task_id not in self.tasks:
             raise ValueError(f"Task {task_id} not found")
         
-        self.task_status[task_id] = TaskStatus.RUNNING
+        self._set_status(task_id, TaskStatus.RUNNING)
         
         try:
             task_func = self.tasks[task_id]
+            executor = self.task_executors.get(task_id, "inline")
             if asyncio.iscoroutinefunction(task_func):
                 result = await task_func()
-            else:
+            elif executor == "inline":
                 result = task_func()
+            else:
+                # Only the callable goes out and only its result comes back
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._get_executor(executor), task_func)
             
-            self.task_status[task_id] = TaskStatus.SUCCESS
-            self.task_results[task_id] = result
+            self._set_status(task_id, TaskStatus.SUCCESS, result)
             return result
         except Exception as e:
-            self.task_status[task_id] = TaskStatus.FAILED
-            self.task_results[task_id] = {"error": str(e)}
+            self._set_status(task_id, TaskStatus.FAILED, {"error": str(e)})
             raise
     
+    def _get_executor(self, kind: str) -> Executor:
+        """Create pools lazily; they are reused across runs until `close`."""
+        if kind not in self._executors:
+            if kind == "thread":
+                self._executors[kind] = ThreadPoolExecutor(
+                    max_workers=self.thread_workers, thread_name_prefix="workflow"
+                )
+            else:
+                self._executors[kind] = ProcessPoolExecutor(max_workers=self.process_workers)
+        return self._executors[kind]
+    
+    def close(self):
+        """Shut down executor pools."""
+        for pool in self._executors.values():
+            pool.shutdown(wait=True)
+        self._executors.clear()
+    
+    def approve(self, task_id: str, approved: bool = True):
+        """Record a human decision for a gated task.
+        
+        Safe to call from any thread (e.g. a web handler). A decision made
+        before the task reaches its gate is kept and applied when it does.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._resolve_approval(task_id, approved)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._resolve_approval(task_id, approved)
+        else:
+            loop.call_soon_threadsafe(self._resolve_approval, task_id, approved)
+    
+    def reject(self, task_id: str):
+        """Reject a gated task; it fails and its dependents don't run."""
+        self.approve(task_id, approved=False)
+    
+    def pending_approvals(self) -> List[str]:
+        """Tasks currently parked at an approval gate."""
+        return list(self._approval_futures)
+    
+    def _resolve_approval(self, task_id: str, approved: bool):
+        future = self._approval_futures.get(task_id)
+        if future is not None:
+            if not future.done():
+                future.set_result(approved)
+        else:
+            self._early_approvals[task_id] = approved
+    
+    async def _escalate(self, task_id: str, level: int):
+        if self.on_escalate is None:
+            print(f"[ESCALATION] Task {task_id} still awaiting approval (level {level})")
+            return
+        outcome = self.on_escalate(task_id, level)
+        if asyncio.iscoroutine(outcome):
+            await outcome
+    
     async def wait_for_human_approval(self, task_id: str) -> bool:
-        """Wait for human approval (simulated)."""
-        self.task_status[task_id] = TaskStatus.WAITING_HUMAN
+        """Park until `approve`/`reject` is called for this task.
+        
+        Only the calling coroutine waits; timeouts and escalation follow the
+        task's gate settings from `add_task` (no timeout if it has none).
+        """
+        self._set_status(task_id, TaskStatus.WAITING_HUMAN)
         print(f"[HUMAN-IN-THE-LOOP] Task {task_id} requires approval")
-        # Simulate approval after delay
-        await asyncio.sleep(1)
-        approval = True  # In production: actual human input
+        if task_id in self._early_approvals:
+            approval = self._early_approvals.pop(task_id)
+            self.human_approvals[task_id] = approval
+            return approval
+        
+        gate = self.approval_gates.get(task_id, {})
+        timeout = gate.get("timeout")
+        future = asyncio.get_running_loop().create_future()
+        self._approval_futures[task_id] = future
+        try:
+            level = 0
+            while True:
+                try:
+                    # shield: a timeout must not cancel the pending decision
+                    approval = await asyncio.wait_for(asyncio.shield(future), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    if level < gate.get("escalations", 0):
+                        level += 1
+                        await self._escalate(task_id, level)
+                        continue
+                    approval = gate.get("on_timeout") == "approve"
+                    print(f"[HUMAN-IN-THE-LOOP] Task {task_id} approval timed out "
+                          f"({'approved' if approval else 'rejected'})")
+                    break
+        finally:
+            del self._approval_futures[task_id]
         self.human_approvals[task_id] = approval
         return approval
     
-    async def execute_workflow(self, start_tasks: List[str]) -> Dict:
-        """Execute workflow starting from given tasks."""
-        executed = set()
-        queue = start_tasks.copy()
-        
-        while queue:
-            # Find tasks ready to execute
-            ready_tasks = [
-                task_id for task_id in queue
-                if self.can_execute(task_id) and task_id not in executed
-            ]
-            
-            if not ready_tasks:
-                # Check for human approvals needed
-                waiting = [
-                    task_id for task_id, status in self.task_status.items()
-                    if status == TaskStatus.WAITING_HUMAN
-                ]
-                if waiting:
-                    for task_id in waiting:
-                        approved = await self.wait_for_human_approval(task_id)
-                        if approved:
-                            self.task_status[task_id] = TaskStatus.SUCCESS
+    async def execute_workflow(self, start_tasks: List[str], run_id: Optional[str] = None) -> Dict:
+        """Execute workflow starting from given tasks.
+        
+        Ready tasks are launched into an asyncio.TaskGroup as soon as their
+        dependencies succeed, so independent branches overlap and wall-clock
+        time approaches the critical path. Each task keeps a counter of unmet
+        dependencies; a completion decrements its dependents' counters and
+        pushes those reaching zero onto the ready queue.
+        
+        `run_id` names the checkpoint journal file (a new id is generated when
+        omitted); it is returned in the result.
+        """
+        if self.journal:
+            if run_id is None:
+                run_id = uuid.uuid4().hex
+            if not self.journal.exists(run_id):
+                self.journal.start_run(run_id, start_tasks)
+            self.journal.start()
+        self.run_id = run_id
+        self._loop = asyncio.get_running_loop()
+        try:
+            return await self._run_workflow(start_tasks)
+        finally:
+            if self.journal:
+                await self.journal.stop()
+    
+    async def resume(self, run_id: str, start_tasks: Optional[List[str]] = None) -> Dict:
+        """Continue a checkpointed run, skipping tasks that already succeeded.
+        
+        Tasks must be registered again with `add_task` before resuming.
+        Results are restored from the journal (as JSON; non-JSON values come
+        back as strings).
+        """
+        if not self.journal or not self.journal.exists(run_id):
+            raise ValueError(f"No checkpoint journal for run {run_id}")
+        state = self.journal.load(run_id)
+        for task_id, status in state["status"].items():
+            if task_id in self.tasks and status == TaskStatus.SUCCESS.value:
+                self.task_status[task_id] = TaskStatus.SUCCESS
+                self.task_results[task_id] = state["results"].get(task_id)
+        return await self.execute_workflow(start_tasks or state["start_tasks"], run_id=run_id)
+    
+    async def _run_workflow(self, start_tasks: List[str]) -> Dict:
+        unmet: Dict[str, int] = {}
+        scheduled = set()
+        ready = deque()
+        gated = deque()  # waiting to be parked at their approval gate
+        cleared = set()  # gated tasks approved in this run
+        in_flight = 0
+        
+        def enqueue(task_id: str):
+            if task_id in self.approval_gates and task_id not in cleared:
+                gated.append(task_id)
+            else:
+                ready.append(task_id)
+        
+        def offer(task_id: str):
+            """Task reached from the start set or released by a dependency."""
+            if task_id in scheduled or task_id not in self.tasks:
+                return
+            if task_id not in unmet:
+                unmet[task_id] = sum(
+                    1 for dep in self.dependencies[task_id]
+                    if self.task_status.get(dep) != TaskStatus.SUCCESS
+                )
+            else:
+                unmet[task_id] -= 1
+            if unmet[task_id] == 0:
+                scheduled.add(task_id)
+                if self.task_status[task_id] == TaskStatus.SUCCESS:
+                    release(task_id)  # finished before a resume: don't rerun
                 else:
-                    break  # Deadlock or all done
-            
-            # Execute ready tasks
-            for task_id in ready_tasks:
-                try:
-                    await self.execute_task(task_id)
-                    executed.add(task_id)
-                    queue.remove(task_id)
-                    
-                    # Add dependent tasks to queue
-                    for next_task, deps in self.dependencies.items():
-                        if task_id in deps and next_task not in queue:
-                            queue.append(next_task)
-                except Exception as e:
-                    print(f"Task {task_id} failed: {e}")
+                    enqueue(task_id)
+        
+        def release(task_id: str):
+            # Only this task's dependents: O(out-degree)
+            for next_task in self.dependents.get(task_id, []):
+                offer(next_task)
+        
+        async def run(task_id: str, tg: asyncio.TaskGroup):
+            nonlocal in_flight
+            try:
+                await self.execute_task(task_id)
+                succeeded = True
+            except Exception as e:
+                # Contained here so one failure doesn't cancel sibling tasks
+                print(f"Task {task_id} failed: {e}")
+                succeeded = False
+            in_flight -= 1
+            if succeeded:
+                release(task_id)
+            dispatch(tg)
+        
+        async def gate(task_id: str, tg: asyncio.TaskGroup):
+            # Parked outside the concurrency limit; only this task waits
+            approved = await self.wait_for_human_approval(task_id)
+            if approved:
+                cleared.add(task_id)
+                ready.append(task_id)
+                dispatch(tg)
+            else:
+                self._set_status(task_id, TaskStatus.FAILED, {"error": "approval rejected"})
+                print(f"Task {task_id} rejected")
+        
+        def dispatch(tg: asyncio.TaskGroup):
+            nonlocal in_flight
+            while gated:
+                tg.create_task(gate(gated.popleft(), tg))
+            while ready and (self.max_concurrency is None or in_flight < self.max_concurrency):
+                in_flight += 1
+                tg.create_task(run(ready.popleft(), tg))
+        
+        for task_id in dict.fromkeys(start_tasks):
+            if task_id not in self.tasks or task_id in scheduled or task_id in unmet:
+                continue
+            if self.task_status[task_id] == TaskStatus.SUCCESS:
+                scheduled.add(task_id)
+                release(task_id)  # already done (e.g. resumed run): continue below it
+            else:
+                # Queued now, or released once a dependency (maybe another start task) finishes
+                offer(task_id)
+        
+        async with asyncio.TaskGroup() as tg:
+            dispatch(tg)
         
         return {
             "status": "completed",
+            "run_id": self.run_id,
             "results": self.task_results,
             "task_status": {k: v.value for k, v in self.task_status.items()}
         }
@@ -160,13 +460,18 @@ def main():
     
     orchestrator = WorkflowOrchestrator()
     
-    # Define workflow DAG
+    # Define workflow DAG; the automated action needs an operator's sign-off
     orchestrator.add_task("analyze", analyze_incident)
     orchestrator.add_task("notify", notify_team, depends_on=["analyze"])
-    orchestrator.add_task("action", take_action, depends_on=["analyze", "notify"])
+    orchestrator.add_task(
+        "action", take_action, depends_on=["analyze", "notify"],
+        requires_approval=True, approval_timeout=5.0, escalations=1,
+    )
     
     # Execute workflow
     async def run():
+        # Stand-in for an operator approving from another thread (e.g. a web UI)
+        threading.Timer(1.5, orchestrator.approve, args=("action",)).start()
         results = await orchestrator.execute_workflow(["analyze"])
         print("\nWorkflow Results:")
         print(results)
@@ -3,11 +3,17 @@ import pytest
 import asyncio
 import sys
 import os
+import time
+from functools import partial
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'solution'))
 
 try:
     from workflow_system import WorkflowOrchestrator, TaskStatus
+    from workflow_journal import CheckpointJournal
+    from workflow_distributed import (
+        DistributedOrchestrator, InProcessTransport, SQLiteTransport, Transport, Worker, spawn_workers,
+    )
     HAS_SOLUTION = True
 except ImportError:
     HAS_SOLUTION = False
@@ -26,5 +32,372 @@ def test_workflow_orchestrator():
     assert "task1" in orchestrator.tasks
 
 
+def sleeper(seconds, value=None, log=None):
+    async def task():
+        if log is not None:
+            log.append(("start", value))
+        await asyncio.sleep(seconds)
+        if log is not None:
+            log.append(("end", value))
+        return value
+    return task
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_independent_branches_run_concurrently():
+    orchestrator = WorkflowOrchestrator()
+    orchestrator.add_task("root", sleeper(0.05, "root"))
+    for name in ("a", "b", "c"):
+        orchestrator.add_task(name, sleeper(0.2, name), depends_on=["root"])
+    orchestrator.add_task("join", sleeper(0.05, "join"), depends_on=["a", "b", "c"])
+
+    start = time.perf_counter()
+    result = asyncio.run(orchestrator.execute_workflow(["root"]))
+    elapsed = time.perf_counter() - start
+
+    assert set(result["task_status"].values()) == {"success"}
+    assert elapsed < 0.5  # critical path is 0.3s; serial would be 0.7s
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_concurrency_limit_and_failure_isolation():
+    log = []
+    orchestrator = WorkflowOrchestrator(max_concurrency=2)
+
+    def boom():
+        raise RuntimeError("boom")
+
+    orchestrator.add_task("bad", boom)
+    for name in ("a", "b", "c"):
+        orchestrator.add_task(name, sleeper(0.05, name, log))
+    orchestrator.add_task("after_bad", sleeper(0.01, "after_bad"), depends_on=["bad"])
+
+    result = asyncio.run(orchestrator.execute_workflow(["bad", "a", "b", "c"]))
+    status = result["task_status"]
+    assert status["bad"] == "failed"
+    assert status["after_bad"] == "pending"
+    assert all(status[n] == "success" for n in ("a", "b", "c"))
+
+    running = peak = 0
+    for event, _ in log:
+        running += 1 if event == "start" else -1
+        peak = max(peak, running)
+    assert peak <= 2
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_start_set_with_dependent_pair():
+    log = []
+    orchestrator = WorkflowOrchestrator()
+    orchestrator.add_task("a", sleeper(0.01, "a", log))
+    orchestrator.add_task("b", sleeper(0.01, "b", log), depends_on=["a"])
+    orchestrator.add_task("c", sleeper(0.01, "c", log), depends_on=["a", "b"])
+
+    for start in (["a", "b"], ["b", "a"], ["c", "b", "a"]):
+        log.clear()
+        orchestrator.task_status = {name: TaskStatus.PENDING for name in orchestrator.tasks}
+        result = asyncio.run(orchestrator.execute_workflow(start))
+        assert set(result["task_status"].values()) == {"success"}
+        assert [v for event, v in log if event == "start"] == ["a", "b", "c"]
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_add_task_rejects_cycles():
+    orchestrator = WorkflowOrchestrator()
+    orchestrator.add_task("a", sleeper(0), depends_on=["c"])  # forward reference
+    orchestrator.add_task("b", sleeper(0), depends_on=["a"])
+    with pytest.raises(ValueError):
+        orchestrator.add_task("c", sleeper(0), depends_on=["b"])
+    with pytest.raises(ValueError):
+        orchestrator.add_task("d", sleeper(0), depends_on=["d"])
+    orchestrator.add_task("c", sleeper(0))
+    assert orchestrator.dependents == {"c": ["a"], "a": ["b"]}
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_large_fan_out_fan_in_dag():
+    orchestrator = WorkflowOrchestrator(max_concurrency=64)
+
+    async def noop():
+        return None
+
+    n = 20_000
+    orchestrator.add_task("root", noop)
+    for i in range(n):
+        orchestrator.add_task(f"device_{i}", noop, depends_on=["root"])
+    orchestrator.add_task("report", noop, depends_on=[f"device_{i}" for i in range(n)])
+
+    start = time.perf_counter()
+    result = asyncio.run(orchestrator.execute_workflow(["root"]))
+    assert result["task_status"]["report"] == "success"
+    assert time.perf_counter() - start < 10
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_resume_skips_completed_tasks(tmp_path):
+    calls = []
+
+    def build(hang_on_restart):
+        orchestrator = WorkflowOrchestrator(journal=CheckpointJournal(str(tmp_path)))
+
+        async def analyze():
+            calls.append("analyze")
+            return {"severity": "high"}
+
+        async def notify():
+            calls.append("notify")
+            return {"notified": True}
+
+        async def action():
+            calls.append("action")
+            if hang_on_restart:
+                await asyncio.sleep(10)  # "crash" while this is running
+            return "restarted"
+
+        orchestrator.add_task("analyze", analyze)
+        orchestrator.add_task("notify", notify, depends_on=["analyze"])
+        orchestrator.add_task("action", action, depends_on=["notify"])
+        return orchestrator
+
+    first = build(hang_on_restart=True)
+
+    async def crash():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(first.execute_workflow(["analyze"], run_id="run1"), 0.3)
+
+    asyncio.run(crash())
+    assert calls == ["analyze", "notify", "action"]
+
+    calls.clear()
+    resumed = build(hang_on_restart=False)
+    result = asyncio.run(resumed.resume("run1"))
+    # analyze and notify are restored from the journal, not rerun
+    assert calls == ["action"]
+    assert result["results"]["notify"] == {"notified": True}
+    assert result["task_status"] == {"analyze": "success", "notify": "success", "action": "success"}
+
+    state = CheckpointJournal(str(tmp_path)).load("run1")
+    assert state["start_tasks"] == ["analyze"]
+    assert state["status"] == {"analyze": "success", "notify": "success", "action": "success"}
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_journal_stop_waits_for_in_flight_batch(tmp_path):
+    class SlowJournal(CheckpointJournal):
+        def _write(self, buffers):
+            if not hasattr(self, "slowed"):
+                self.slowed = True
+                time.sleep(0.2)  # only the first batch is slow
+            super()._write(buffers)
+
+    async def run():
+        journal = SlowJournal(str(tmp_path), flush_interval=0.01)
+        journal.start()
+        journal.record("run1", "task", "running")
+        await asyncio.sleep(0.05)  # the flusher is now inside the slow write
+        journal.record("run1", "task", "success", {"ok": True})
+        await journal.stop()
+        return journal
+
+    journal = asyncio.run(run())
+    state = journal.load("run1")
+    assert state["status"] == {"task": "success"}
+    assert state["results"] == {"task": {"ok": True}}
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_thread_and_process_executors():
+    log = []
+    orchestrator = WorkflowOrchestrator(thread_workers=2, process_workers=2)
+
+    def blocking():
+        time.sleep(0.3)
+        log.append(("end", "blocking"))
+
+    orchestrator.add_task("blocking", blocking, executor="thread")
+    orchestrator.add_task("cpu", partial(sum, range(100_000)), executor="process")
+    orchestrator.add_task("async", sleeper(0.05, "async", log))
+    orchestrator.add_task("inline", partial(len, "abc"))
+
+    try:
+        result = asyncio.run(orchestrator.execute_workflow(["blocking", "cpu", "async", "inline"]))
+    finally:
+        orchestrator.close()
+
+    assert set(result["task_status"].values()) == {"success"}
+    assert result["results"]["cpu"] == sum(range(100_000))
+    assert result["results"]["inline"] == 3
+    # The blocking call ran off the loop, so the async task wasn't held up by it
+    assert log.index(("end", "async")) < log.index(("end", "blocking"))
+
+    with pytest.raises(ValueError):
+        orchestrator.add_task("lambda", lambda: 1, executor="process")
+    with pytest.raises(ValueError):
+        orchestrator.add_task("coro", sleeper(0), executor="thread")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_approval_gate_parks_only_gated_task():
+    log = []
+    orchestrator = WorkflowOrchestrator(max_concurrency=1)
+    orchestrator.add_task("root", sleeper(0.01, "root", log))
+    orchestrator.add_task("gated", sleeper(0.01, "gated", log), depends_on=["root"],
+                          requires_approval=True)
+    orchestrator.add_task("after", sleeper(0.01, "after", log), depends_on=["gated"])
+    for i in range(5):
+        orchestrator.add_task(f"other{i}", sleeper(0.02, f"other{i}", log), depends_on=["root"])
+
+    async def run():
+        async def operator():
+            # Approve from another thread once everything else has finished
+            while orchestrator.task_status["other4"] != TaskStatus.SUCCESS:
+                await asyncio.sleep(0.01)
+            assert orchestrator.pending_approvals() == ["gated"]
+            await asyncio.to_thread(orchestrator.approve, "gated")
+
+        waiter = asyncio.create_task(operator())
+        result = await orchestrator.execute_workflow(["root"])
+        await waiter
+        return result
+
+    result = asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert set(result["task_status"].values()) == {"success"}
+    assert orchestrator.human_approvals == {"gated": True}
+    # The gate held no concurrency slot: the other branches ran while it waited
+    assert log.index(("end", "other4")) < log.index(("start", "gated"))
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_approval_timeout_escalates_then_rejects():
+    escalated = []
+    orchestrator = WorkflowOrchestrator(on_escalate=lambda task, level: escalated.append((task, level)))
+    orchestrator.add_task("gated", sleeper(0, "gated"), requires_approval=True,
+                          approval_timeout=0.05, escalations=2)
+    orchestrator.add_task("after", sleeper(0, "after"), depends_on=["gated"])
+    orchestrator.add_task("auto", sleeper(0, "auto"), requires_approval=True,
+                          approval_timeout=0.05, on_timeout="approve")
+    orchestrator.add_task("early", sleeper(0, "early"), requires_approval=True)
+    orchestrator.reject("early")  # decided before the run starts
+
+    result = asyncio.run(orchestrator.execute_workflow(["gated", "auto", "early"]))
+
+    assert escalated == [("gated", 1), ("gated", 2)]
+    assert result["task_status"]["gated"] == "failed"
+    assert result["task_status"]["after"] == "pending"
+    assert result["task_status"]["auto"] == "success"
+    assert result["task_status"]["early"] == "failed"
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_distributed_workers_and_lost_lease():
+    import threading
+
+    transport = InProcessTransport()
+    orchestrator = DistributedOrchestrator(transport)
+    orchestrator.add_task("add", "operator:add", args=[2, 3])
+    orchestrator.add_task("sleep", "time:sleep", depends_on=["add"], args=[0.01])
+    orchestrator.add_task("bad", "math:sqrt", depends_on=["add"], args=[-1])
+    orchestrator.add_task("local", sleeper(0, "local"), depends_on=["add"])
+
+    async def run():
+        workflow = asyncio.create_task(orchestrator.execute_workflow(["add"]))
+        # A worker leases the first job and dies without heartbeating
+        while transport.lease("dead", lease_seconds=0.1) is None:
+            await asyncio.sleep(0.005)
+        stop = threading.Event()
+        worker = Worker(transport, lease_seconds=1.0, poll_interval=0.01)
+        pulling = asyncio.create_task(asyncio.to_thread(worker.run, stop))
+        try:
+            await workflow
+        finally:
+            stop.set()
+            await pulling
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert orchestrator.task_results["add"] == 5  # re-leased after the lease expired
+    assert orchestrator.task_status["sleep"] == TaskStatus.SUCCESS
+    assert orchestrator.task_status["local"] == TaskStatus.SUCCESS
+    assert orchestrator.task_status["bad"] == TaskStatus.FAILED
+    assert "ValueError" in orchestrator.task_results["bad"]["error"]
+    with pytest.raises(ValueError):
+        orchestrator.add_task("ref", "not-a-reference")
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_coordinators_collect_only_their_own_results(tmp_path):
+    with pytest.raises(TypeError):
+        Transport()  # abstract
+
+    path = str(tmp_path / "queue.sqlite")
+    for transport in (InProcessTransport(), SQLiteTransport(path)):
+        for owner in ("a", "b"):
+            transport.submit({"id": f"{owner}-job", "owner": owner, "task": "t", "fn": "operator:add"})
+            job = transport.lease("w", lease_seconds=10)
+            transport.complete("w", job["id"], result=owner)
+        assert transport.collect("a") == [{"id": "a-job", "result": "a", "error": None}]
+        assert transport.collect("a") == []
+        assert transport.collect("b") == [{"id": "b-job", "result": "b", "error": None}]
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_poller_survives_and_reports_collect_errors():
+    import sqlite3
+    import threading
+
+    class FlakyTransport(InProcessTransport):
+        def __init__(self, failures):
+            super().__init__()
+            self.failures = failures
+
+        def collect(self, owner=None):
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return super().collect(owner)
+
+    def run(transport):
+        orchestrator = DistributedOrchestrator(transport, poll_interval=0.001, max_collect_failures=4)
+        orchestrator.add_task("add", "operator:add", args=[2, 3])
+        stop = threading.Event()
+        worker = threading.Thread(target=Worker(transport, poll_interval=0.001).run, args=(stop,))
+        worker.start()
+        try:
+            return asyncio.run(asyncio.wait_for(orchestrator.execute_workflow(["add"]), 5))
+        finally:
+            stop.set()
+            worker.join()
+
+    recovered = run(FlakyTransport(failures=3))
+    assert recovered["results"]["add"] == 5
+
+    broken = run(FlakyTransport(failures=1000))
+    assert broken["task_status"]["add"] == "failed"
+    assert "database is locked" in broken["results"]["add"]["error"]
+
+
+@pytest.mark.skipif(not HAS_SOLUTION, reason="Solution not available")
+def test_sqlite_transport_worker_processes(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    orchestrator = DistributedOrchestrator(SQLiteTransport(path))
+    orchestrator.add_task("root", "operator:mul", args=[6, 7])
+    for i in range(8):
+        orchestrator.add_task(f"sleep{i}", "time:sleep", depends_on=["root"], args=[0.2])
+
+    workers = spawn_workers(path, 4, idle_timeout=2.0)
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(asyncio.wait_for(orchestrator.execute_workflow(["root"]), 20))
+        elapsed = time.perf_counter() - start
+    finally:
+        for process in workers:
+            process.join(timeout=10)
+
+    assert set(result["task_status"].values()) == {"success"}
+    assert result["results"]["root"] == 42
+    assert elapsed < 1.2  # 8 x 0.2s sleeps over 4 processes
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])